@@ -0,0 +1,38 @@
+from tools.aws_model_gen import AwsModel, AwsProperty
+
+
+def test_to_class() -> None:
+    props = [
+        AwsProperty("instance_type", "InstanceType", "str", "The <b>type</b> of the instance."),
+        AwsProperty("cpu_options", "CpuOptions", "AwsEc2CpuOptions", "", is_complex=True),
+    ]
+    api_info = ("ec2", "describe-instances", "Reservations")
+    root = AwsModel("AwsEc2Instance", props, aggregate_root=True, base_class="BaseInstance", api_info=api_info)
+    assert root.to_class() == (
+        "@define(eq=False, slots=False)\n"
+        "class AwsEc2Instance(AwsResource, BaseInstance):\n"
+        '    kind: ClassVar[str] = "aws_ec2_instance"\n'
+        '    api_spec: ClassVar[AwsApiSpec] = AwsApiSpec("ec2", "describe-instances", "Reservations")\n'
+        "    mapping: ClassVar[Dict[str, Bender]] = {\n"
+        '        "id": S("id"),\n'
+        '        "tags": S("Tags", default=[]) >> ToDict(),\n'
+        '        "name": S("Tags", default=[]) >> TagsValue("Name"),\n'
+        '        "ctime": K(None),\n'
+        '        "mtime": K(None),\n'
+        '        "atime": K(None),\n'
+        '        "instance_type": S("InstanceType"),\n'
+        '        "cpu_options": S("CpuOptions") >> Bend(AwsEc2CpuOptions.mapping)\n'
+        "    }\n"
+        '    instance_type: Optional[str] = field(default=None, metadata={"description": "The type of the instance."})  # fmt: skip\n'  # noqa: E501
+        '    cpu_options: Optional[AwsEc2CpuOptions] = field(default=None, metadata={"description": ""})  # fmt: skip\n'
+    )
+    # a class without properties keeps an empty mapping and ends with an empty line
+    assert AwsModel("AwsWafMethod", [], aggregate_root=False).to_class() == (
+        "@define(eq=False, slots=False)\n"
+        "class AwsWafMethod:\n"
+        '    kind: ClassVar[str] = "aws_waf_method"\n'
+        "    mapping: ClassVar[Dict[str, Bender]] = {\n"
+        "\n"
+        "    }\n"
+        "\n"
+    )
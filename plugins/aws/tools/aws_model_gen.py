@@ -1,22 +1,71 @@
+import html
 import json  # noqa: F401
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from string import ascii_lowercase, ascii_uppercase, digits
 from textwrap import dedent
-from typing import List, Set, Optional, Tuple, Union, Dict
+from types import MappingProxyType
+from typing import List, Set, Optional, Tuple, Union, Dict, Iterator, Callable, Any, Mapping
 
-import boto3
-from attrs import define
-from bs4 import BeautifulSoup  # pip install beautifulsoup4 lxml
+from attrs import define, field
 from botocore.model import ServiceModel, StringShape, ListShape, Shape, StructureShape, MapShape
-from jsons import pascalcase
+from botocore.session import Session
+from jinja2 import Environment
 
 from resotolib.types import JsonElement
 from resotolib.utils import utc_str
 
+html_tag_re = re.compile(r"<[^>]+>")
+
+# mapping of the properties every aggregate root defines
+base_mapping = {
+    "id": 'S("id")',
+    "tags": 'S("Tags", default=[]) >> ToDict()',
+    "name": 'S("Tags", default=[]) >> TagsValue("Name")',
+    "ctime": "K(None)",
+    "mtime": "K(None)",
+    "atime": "K(None)",
+}
+
+# source of a generated class: the template is compiled once
+class_template = Environment(trim_blocks=True, keep_trailing_newline=True).from_string(
+    dedent(
+        """\
+        @define(eq=False, slots=False)
+        class {{ name }}{{ base }}
+            kind: ClassVar[str] = "{{ kind }}"
+        {% if api_info %}
+            api_spec: ClassVar[AwsApiSpec] = AwsApiSpec("{{ api_info[0] }}", "{{ api_info[1] }}", "{{ api_info[2] }}")
+        {% endif %}
+            mapping: ClassVar[Dict[str, Bender]] = {
+        {{ mapping }}
+            }
+        {% for p in props %}
+            {{ p.name }}: {{ p.type_string() }} = {{ p.assignment() }}
+        {% else %}
+
+        {% endfor %}
+        """
+    )
+)
+
+
+@lru_cache(maxsize=4096)
+def clean_description(documentation: str) -> str:
+    # the documentation is html: only the text is of interest. The same documentation is used by many shapes.
+    return html.unescape(html_tag_re.sub("", documentation)).strip()
+
+
+def property_path(name: Union[str, List[str]]) -> Tuple[str, ...]:
+    # a property is either defined by a name or by a path of names
+    return (name,) if isinstance(name, str) else tuple(name)
+
 
 @define
 class AwsProperty:
     name: str
-    from_name: Union[str, List[str]]
+    from_name: Tuple[str, ...] = field(converter=property_path)
     type: str
     description: str
     is_array: bool = False
@@ -24,34 +73,41 @@ class AwsProperty:
     field_default: Optional[str] = None
     extractor: Optional[str] = None
 
-    def assignment(self) -> str:
-        default = self.field_default or ("factory=list" if self.is_array else "default=None")
-        description = BeautifulSoup(self.description, "lxml").get_text().strip()
-        return f'field({default}, metadata={{"description": "{description}"}})  # fmt: skip'
+    # rendered source fragments: computed once from the values above
+    _type_str: str = field(init=False, repr=False)
+    _mapping_str: str = field(init=False, repr=False)
+    _assignment_str: str = field(init=False, repr=False)
 
-    def type_string(self) -> str:
-        if self.is_array:
-            return f"Optional[List[{self.type}]]"
-        else:
-            return f"Optional[{self.type}]"
+    def __attrs_post_init__(self) -> None:
+        self.description = clean_description(self.description or "")
+        self._type_str = f"Optional[List[{self.type}]]" if self.is_array else f"Optional[{self.type}]"
+        self._mapping_str = self._render_mapping()
+        default = self.field_default or ("factory=list" if self.is_array else "default=None")
+        self._assignment_str = f'field({default}, metadata={{"description": "{self.description}"}})  # fmt: skip'
 
-    def mapping(self) -> str:
+    def _render_mapping(self) -> str:
         # in case an extractor is defined explicitly
         if self.extractor:
             return f'"{self.name}": {self.extractor}'
-        from_p = self.from_name if isinstance(self.from_name, list) else [self.from_name]
-        from_p_path = ",".join(f'"{p}"' for p in from_p)
+        from_p_path = ",".join(f'"{p}"' for p in self.from_name)
         base = f'"{self.name}": S({from_p_path}'
         if self.is_array and self.is_complex:
-            base += f", default=[]) >> ForallBend({self.type}.mapping)"
+            return base + f", default=[]) >> ForallBend({self.type}.mapping)"
         elif self.is_array:
-            base += ", default=[])"
+            return base + ", default=[])"
         elif self.is_complex:
-            base += f") >> Bend({self.type}.mapping)"
+            return base + f") >> Bend({self.type}.mapping)"
         else:
-            base += ")"
+            return base + ")"
 
-        return base
+    def assignment(self) -> str:
+        return self._assignment_str
+
+    def type_string(self) -> str:
+        return self._type_str
+
+    def mapping(self) -> str:
+        return self._mapping_str
 
 
 @define
@@ -64,29 +120,17 @@ class AwsModel:
 
     def to_class(self) -> str:
         bc = ", " + self.base_class if self.base_class else ""
-        base = f"(AwsResource{bc}):" if self.aggregate_root else ":"
-        kind = f'    kind: ClassVar[str] = "aws_{to_snake(self.name[3:])}"'
-        if self.api_info:
-            srv, act, res = self.api_info
-            api = f'    api_spec: ClassVar[AwsApiSpec] = AwsApiSpec("{srv}", "{act}", "{res}")\n'
-        else:
-            api = ""
-        base_mapping = {
-            "id": 'S("id")',
-            "tags": 'S("Tags", default=[]) >> ToDict()',
-            "name": 'S("Tags", default=[]) >> TagsValue("Name")',
-            "ctime": "K(None)",
-            "mtime": "K(None)",
-            "atime": "K(None)",
-        }
-        mapping = "    mapping: ClassVar[Dict[str, Bender]] = {\n"
-        if self.aggregate_root:
-            mapping += ",\n".join(f'        "{k}": {v}' for k, v in base_mapping.items())
-            mapping += ",\n"
+        # the mapping of an aggregate root always ends with a comma after the base properties
+        mapping = "".join(f'        "{k}": {v},\n' for k, v in base_mapping.items()) if self.aggregate_root else ""
         mapping += ",\n".join(f"        {p.mapping()}" for p in self.props)
-        mapping += "\n    }"
-        props = "\n".join(f"    {p.name}: {p.type_string()} = {p.assignment()}" for p in self.props)
-        return f"@define(eq=False, slots=False)\nclass {self.name}{base}\n{kind}\n{api}{mapping}\n{props}\n"
+        return class_template.render(
+            name=self.name,
+            base=f"(AwsResource{bc}):" if self.aggregate_root else ":",
+            kind=f"aws_{to_snake(self.name[3:])}",
+            api_info=self.api_info,
+            mapping=mapping,
+            props=self.props,
+        )
 
 
 @define
@@ -100,33 +144,125 @@ class AwsResotoModel:
     base: Optional[str] = None  # the base class to use, BaseResource otherwise
 
 
+@lru_cache(maxsize=None)
 def to_snake(name: str) -> str:
-    name = re.sub("(.)([A-Z][a-z]+)", r"\1_\2", name)
-    name = re.sub("__([A-Z])", r"_\1", name)
-    name = re.sub("([a-z0-9])([A-Z])", r"\1_\2", name)
-    return name.lower()
-
-
-simple_type_map = {
-    "Long": "int",
-    "Float": "float",
-    "Double": "float",
-    "Integer": "int",
-    "Boolean": "bool",
-    "String": "str",
-    "DateTime": "datetime",
-    "Timestamp": "datetime",
-    "TagsMap": "Dict[str, str]",
-    "MillisecondDateTime": "datetime",
-    "SearchString": "str",
-}
-simple_type_map |= {k.lower(): v for k, v in simple_type_map.items()}
+    # Character walk equivalent of the substitutions (.)([A-Z][a-z]+) -> \1_\2, __([A-Z]) -> _\1, ([a-z0-9])([A-Z]) -> \1_\2:
+    # shorten an underscore run in front of an upper case letter that does not start a word by one,
+    # insert an underscore in front of a capitalized word and between a lower case letter or digit and an upper case letter.
+    result: List[str] = []
+    length = len(name)
+    prev = ""
+    idx = 0
+    while idx < length:
+        char = name[idx]
+        if char == "_":
+            end = idx + 1
+            while end < length and name[end] == "_":
+                end += 1
+            run = end - idx
+            next_upper = end < length and name[end] in ascii_uppercase
+            if run > 1 and next_upper and (end + 1 == length or name[end + 1] not in ascii_lowercase):
+                run -= 1
+            result.append("_" * run)
+            prev = "_"
+            idx = end
+            continue
+        if prev and char in ascii_uppercase:
+            if prev in ascii_lowercase or prev in digits:
+                result.append("_")
+            elif prev != "_" and idx + 1 < length and name[idx + 1] in ascii_lowercase:
+                result.append("_")
+        result.append(char)
+        prev = char
+        idx += 1
+    return "".join(result).lower()
+
+
+@lru_cache(maxsize=None)
+def to_pascal(name: str) -> str:
+    # api actions are given in kebab case: list-resource-compliance-summaries -> ListResourceComplianceSummaries
+    return "".join(part[:1].upper() + part[1:] for part in name.replace("-", "_").split("_"))
+
+
+# shape name or shape type -> python type (read only)
+simple_type_map: Mapping[str, str] = MappingProxyType(
+    {
+        "Long": "int",
+        "long": "int",
+        "Float": "float",
+        "float": "float",
+        "Double": "float",
+        "double": "float",
+        "Integer": "int",
+        "integer": "int",
+        "Boolean": "bool",
+        "boolean": "bool",
+        "String": "str",
+        "string": "str",
+        "DateTime": "datetime",
+        "datetime": "datetime",
+        "Timestamp": "datetime",
+        "timestamp": "datetime",
+        "TagsMap": "Dict[str, str]",
+        "tagsmap": "Dict[str, str]",
+        "MillisecondDateTime": "datetime",
+        "milliseconddatetime": "datetime",
+        "SearchString": "str",
+        "searchstring": "str",
+    }
+)
 
 ignore_props = {"Tags", "tags"}
 
 
+botocore_session = Session()
+
+
+@lru_cache(maxsize=None)
 def service_model(name: str) -> ServiceModel:
-    return boto3.client(name, region_name="us-east-1")._service_model
+    # only the service description is needed: no client, credentials or endpoint resolution
+    return botocore_session.get_service_model(name)
+
+
+@lru_cache(maxsize=None)
+def simple_type(shape_name: str, shape_type: str) -> Optional[str]:
+    # string shapes are always str, independent of their name
+    if shape_type == "string":
+        return "str"
+    return simple_type_map.get(shape_name) or simple_type_map.get(shape_type)
+
+
+def simple_shape(s: Shape) -> Optional[str]:
+    # botocore creates new shape objects for every lookup: cache by name and type
+    return simple_type(s.name, s.type_name)
+
+
+def type_name(s: Shape, prefix: str) -> str:
+    spl = simple_shape(s)
+    return spl if spl else f"Aws{prefix}{s.name}"
+
+
+def complex_simple_shape(s: Shape) -> Optional[Tuple[str, str]]:
+    # in case this shape is complex, but has only property of simple type, return that type
+    if isinstance(s, StructureShape) and len(s.members) == 1:
+        p_name, p_shape = next(iter(s.members.items()))
+        p_simple = simple_shape(p_shape)
+        return (p_name, p_simple) if p_simple else None
+    else:
+        return None
+
+
+@define
+class ClazzFrame:
+    # a structure shape that is currently processed by clazz_model
+    shape: StructureShape
+    prop_prefix: str
+    clazz_name: Optional[str]
+    base_class: Optional[str]
+    aggregate_root: bool
+    api_info: Optional[Tuple[str, str, str]]
+    members: Iterator[Tuple[str, Shape]]
+    props: List[AwsProperty] = field(factory=list)
 
 
 def clazz_model(
@@ -139,52 +275,52 @@ def clazz_model(
     aggregate_root: bool = False,
     api_info: Optional[Tuple[str, str, str]] = None,
 ) -> List[AwsModel]:
-    def type_name(s: Shape) -> str:
-        spl = simple_shape(s)
-        return spl if spl else f"Aws{prefix}{s.name}"
-
-    def simple_shape(s: Shape) -> Optional[str]:
-        if isinstance(s, StringShape):
-            return "str"
-        elif simple := simple_type_map.get(s.name):
-            return simple
-        elif simple := simple_type_map.get(s.type_name):
-            return simple
-        else:
-            return None
-
-    def complex_simple_shape(s: Shape) -> Optional[Tuple[str, str]]:
-        # in case this shape is complex, but has only property of simple type, return that type
-        if isinstance(s, StructureShape) and len(s.members) == 1:
-            p_name, p_shape = next(iter(s.members.items()))
-            p_simple = simple_shape(p_shape)
-            return (p_name, p_simple) if p_simple else None
-        else:
-            return None
-
-    if type_name(shape) in visited:
-        return []
-    visited.add(type_name(shape))
-    result: List[AwsModel] = []
-    props = []
     prefix = prefix or ""
-    prop_prefix = prop_prefix or ""
-    if isinstance(shape, StructureShape):
-        for name, prop_shape in shape.members.items():
+    result: List[AwsModel] = []
+    # Shapes are walked depth first using an explicit stack instead of recursion.
+    # A model is emitted after all models of its complex properties, so nested classes come before their parents.
+    stack: List[ClazzFrame] = []
+
+    def enter(
+        s: Shape,
+        p_prefix: str = "",
+        name: Optional[str] = None,
+        base: Optional[str] = None,
+        root: bool = False,
+        api: Optional[Tuple[str, str, str]] = None,
+    ) -> bool:
+        # simple shapes do not define a class: they are neither tracked nor walked
+        if simple_shape(s):
+            return False
+        s_name = f"Aws{prefix}{s.name}"
+        if s_name in visited:
+            return False
+        visited.add(s_name)
+        if isinstance(s, StructureShape):
+            stack.append(ClazzFrame(s, p_prefix, name, base, root, api, iter(s.members.items())))
+            return True
+        return False
+
+    enter(shape, prop_prefix or "", clazz_name, base_class, aggregate_root, api_info)
+    while stack:
+        frame = stack[-1]
+        props = frame.props
+        pp = frame.prop_prefix
+        for name, prop_shape in frame.members:
             prop = to_snake(name)
             if prop in ignore_props:
                 continue
             if simple := simple_shape(prop_shape):
-                props.append(AwsProperty(prop_prefix + prop, name, simple, prop_shape.documentation))
+                props.append(AwsProperty(pp + prop, name, simple, prop_shape.documentation))
             elif isinstance(prop_shape, ListShape):
                 inner = prop_shape.member
                 if simple := simple_shape(inner):
-                    props.append(AwsProperty(prop_prefix + prop, name, simple, prop_shape.documentation, is_array=True))
+                    props.append(AwsProperty(pp + prop, name, simple, prop_shape.documentation, is_array=True))
                 elif simple_path := complex_simple_shape(inner):
                     prop_name, prop_type = simple_path
                     props.append(
                         AwsProperty(
-                            prop_prefix + prop,
+                            pp + prop,
                             [name, prop_name],
                             prop_type,
                             prop_shape.documentation,
@@ -192,123 +328,147 @@ def clazz_model(
                             extractor=f'S("{name}", default=[]) >> ForallBend(S("{prop_name}"))',
                         )
                     )
-
                 else:
-                    result.extend(clazz_model(inner, visited, prefix))
                     props.append(
                         AwsProperty(
-                            prop_prefix + prop,
+                            pp + prop,
                             name,
-                            type_name(inner),
+                            type_name(inner, prefix),
                             prop_shape.documentation,
                             is_array=True,
                             is_complex=True,
                         )
                     )
+                    if enter(inner):
+                        break
             elif isinstance(prop_shape, MapShape):
                 key_type = simple_shape(prop_shape.key)
                 assert key_type, f"Key type must be a simple type: {prop_shape.key.name}"
-                value_type = type_name(prop_shape.value)
-                result.extend(clazz_model(prop_shape.value, visited, prefix))
-                props.append(
-                    AwsProperty(prop_prefix + prop, name, f"Dict[{key_type}, {value_type}]", prop_shape.documentation)
-                )
-
+                value_type = type_name(prop_shape.value, prefix)
+                props.append(AwsProperty(pp + prop, name, f"Dict[{key_type}, {value_type}]", prop_shape.documentation))
+                if enter(prop_shape.value):
+                    break
             elif isinstance(prop_shape, StructureShape):
                 if maybe_simple := complex_simple_shape(prop_shape):
                     s_prop_name, s_prop_type = maybe_simple
-                    props.append(
-                        AwsProperty(prop_prefix + prop, [name, s_prop_name], s_prop_type, prop_shape.documentation)
-                    )
+                    props.append(AwsProperty(pp + prop, [name, s_prop_name], s_prop_type, prop_shape.documentation))
                 else:
-                    result.extend(clazz_model(prop_shape, visited, prefix))
                     props.append(
                         AwsProperty(
-                            prop_prefix + prop, name, type_name(prop_shape), prop_shape.documentation, is_complex=True
+                            pp + prop,
+                            name,
+                            type_name(prop_shape, prefix),
+                            prop_shape.documentation,
+                            is_complex=True,
                         )
                     )
+                    if enter(prop_shape):
+                        break
             else:
                 raise NotImplementedError(f"Unsupported shape: {prop_shape}")
-
-        clazz_name = clazz_name if clazz_name else type_name(shape)
-        result.append(AwsModel(clazz_name, props, aggregate_root, base_class, api_info))
+        else:
+            # all members are processed: the models of all nested shapes have been emitted
+            stack.pop()
+            name = frame.clazz_name if frame.clazz_name else type_name(frame.shape, prefix)
+            result.append(AwsModel(name, props, frame.aggregate_root, frame.base_class, frame.api_info))
     return result
 
 
-def all_models() -> List[AwsModel]:
-    visited: Set[str] = set()
+def service_models(
+    name: str, endpoints: List[AwsResotoModel], visited: Optional[Set[str]] = None
+) -> Tuple[List[AwsModel], Set[str]]:
+    # returns the models of this service and the names of all walked shapes
+    visited = set() if visited is None else visited
     result: List[AwsModel] = []
-    for name, endpoints in models.items():
-        sm = service_model(name)
-        for ep in endpoints:
-            shape = (
-                sm.shape_for(ep.result_shape)
-                if ep.result_shape
-                else sm.operation_model(pascalcase(ep.api_action)).output_shape
-            )
-            result.extend(
-                clazz_model(
-                    shape,
-                    visited,
-                    aggregate_root=True,
-                    clazz_name=ep.name,
-                    base_class=ep.base,
-                    prop_prefix=ep.prop_prefix,
-                    prefix=ep.prefix,
-                    api_info=(name, ep.api_action, ep.result_property),
-                )
+    sm = service_model(name)
+    for ep in endpoints:
+        shape = (
+            sm.shape_for(ep.result_shape)
+            if ep.result_shape
+            else sm.operation_model(to_pascal(ep.api_action)).output_shape
+        )
+        result.extend(
+            clazz_model(
+                shape,
+                visited,
+                aggregate_root=True,
+                clazz_name=ep.name,
+                base_class=ep.base,
+                prop_prefix=ep.prop_prefix,
+                prefix=ep.prefix,
+                api_info=(name, ep.api_action, ep.result_property),
             )
+        )
+    return result, visited
+
+
+def all_models() -> Iterator[AwsModel]:
+    # only services with configured endpoints need their service model loaded
+    services = {name: endpoints for name, endpoints in models.items() if endpoints}
+    # the shapes of every service are walked in a separate process: models are emitted in service order
+    with ProcessPoolExecutor() as pool:
+        per_service = pool.map(service_models, services.keys(), services.values())
+        # a shape (Aws{prefix}{shape name}) walked by a former service is not walked again
+        visited: Set[str] = set()
+        for (name, endpoints), (service_result, service_visited) in zip(services.items(), per_service):
+            if visited.isdisjoint(service_visited):
+                visited.update(service_visited)
+            else:
+                # this service walked shapes of a former service: walk it again, skipping these shapes
+                service_result, _ = service_models(name, endpoints, visited)
+            yield from service_result
+
+
+def sample_string(shape: StringShape) -> JsonElement:
+    if shape.enum:
+        return shape.enum[1]
+    elif "8601" in shape.documentation:
+        return utc_str()
+    elif "URL" in shape.documentation:
+        return "https://example.com"
+    else:
+        return "foo"
+
+
+# shape type name -> function that creates a sample value for a shape of this type
+samplers: Dict[str, Callable[[Any], JsonElement]] = {
+    "string": sample_string,
+    "list": lambda shape: [sample(shape.member) for _ in range(3)],
+    "map": lambda shape: {f"{num}": sample(shape.value) for num in range(3)},
+    "structure": lambda shape: {name: sample(member) for name, member in shape.members.items()},
+    "double": lambda _: 1.234,
+    "integer": lambda _: 123,
+    "boolean": lambda _: True,
+    "long": lambda _: 123,
+    "timestamp": lambda _: utc_str(),
+}
 
-    return result
+
+def sample(shape: Shape) -> JsonElement:
+    if sampler := samplers.get(shape.type_name):
+        return sampler(shape)
+    raise NotImplementedError(f"Unsupported shape: {type(shape)}")
 
 
 def create_test_response(service: str, function: str, is_pascal: bool = False) -> JsonElement:
     sm = service_model(service)
-    op = sm.operation_model(function if is_pascal else pascalcase(function))
-
-    def sample(shape: Shape) -> JsonElement:
-        if isinstance(shape, StringShape) and shape.enum:
-            return shape.enum[1]
-        elif isinstance(shape, StringShape) and "8601" in shape.documentation:
-            return utc_str()
-        elif isinstance(shape, StringShape) and "URL" in shape.documentation:
-            return "https://example.com"
-        elif isinstance(shape, StringShape):
-            return "foo"
-        elif isinstance(shape, ListShape):
-            inner = shape.member
-            return [sample(inner) for _ in range(3)]
-        elif isinstance(shape, MapShape):
-            value_type = shape.value
-            return {f"{num}": sample(value_type) for num in range(3)}
-        elif isinstance(shape, StructureShape):
-            return {name: sample(shape) for name, shape in shape.members.items()}
-        elif shape.type_name == "double":
-            return 1.234
-        elif shape.type_name == "integer":
-            return 123
-        elif shape.type_name == "boolean":
-            return True
-        elif shape.type_name == "long":
-            return 123
-        elif shape.type_name == "timestamp":
-            return utc_str()
-        else:
-            raise NotImplementedError(f"Unsupported shape: {type(shape)}")
-
+    op = sm.operation_model(function if is_pascal else to_pascal(function))
     return sample(op.output_shape)
 
 
+imports_source = dedent(
+    """
+    from typing import ClassVar, Dict, Optional
+    from attr import define, field
+    from resoto_plugin_aws.resource.base import AwsApiSpec, AwsResource
+    from resoto_plugin_aws.utils import ToDict, TagsValue
+    from resotolib.json_bender import Bender, S, K
+    """
+)
+
+
 def default_imports() -> str:
-    return dedent(
-        """
-        from typing import ClassVar, Dict, Optional
-        from attr import define, field
-        from resoto_plugin_aws.resource.base import AwsApiSpec, AwsResource
-        from resoto_plugin_aws.utils import ToDict, TagsValue
-        from resotolib.json_bender import Bender, S, K
-        """
-    )
+    return imports_source
 
 
 models: Dict[str, List[AwsResotoModel]] = {
@@ -940,6 +1100,7 @@ if __name__ == "__main__":
 
     """print the class models"""
     # print(default_imports())
-    for model in all_models():
-        # pass
-        print(model.to_class())
+    # print every class as soon as its service is done: the classes are never held in memory all at once
+    for num, model in enumerate(all_models()):
+        print(("\n" if num else "") + model.to_class(), end="")
+    print()
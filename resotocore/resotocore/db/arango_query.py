@@ -105,6 +105,42 @@ class ArangoQueryContext:
         return bvn
 
 
+# Estimated cost to evaluate a term of this type in a filter statement: the lower, the cheaper.
+predicate_op_cost = {"==": 2, "!=": 2, "<": 3, "<=": 3, ">": 3, ">=": 3, "in": 4, "not in": 4, "=~": 5, "!~": 5}
+
+
+def filter_cost(term: Term, cache: Optional[Dict[int, Tuple[Term, int]]] = None) -> int:
+    """
+    Compute the filter cost of given term.
+    Terms can not be hashed: the optional cache maps the id of an already computed term to the term and its cost.
+    The term is held in the cache, so the id can not be reused by another term while the cache is in use.
+    """
+
+    def cost(t: Term) -> int:
+        if cache is not None and (cached := cache.get(id(t))) is not None:
+            return cached[1]
+        if isinstance(t, (AllTerm, IdTerm)):
+            result = 0
+        elif isinstance(t, IsTerm):
+            result = 1
+        elif isinstance(t, Predicate):
+            result = predicate_op_cost.get(t.op, 5)
+        elif isinstance(t, NotTerm):
+            result = cost(t.term)
+        elif isinstance(t, CombinedTerm):
+            # the most expensive side dominates the cost
+            result = max(cost(t.left), cost(t.right))
+        elif isinstance(t, (FunctionTerm, FulltextTerm)):
+            result = 6
+        else:  # context terms unfold arrays
+            result = 7
+        if cache is not None:
+            cache[id(t)] = (t, result)
+        return result
+
+    return cost(term)
+
+
 def to_query(
     db: Any,
     query_model: QueryModel,
@@ -138,6 +174,8 @@ def query_string(
     model = query_model.model
     # combine merge names from the query as well as the default ancestor merge names
     merge_names: Set[str] = query_model.query.merge_names | ancestor_merges
+    # filter cost per term id: computed only once per term, while terms are traversed top down
+    term_cost: Dict[int, Tuple[Term, int]] = {}
 
     def prop_name_kind(
         path: str, context_path: Optional[str] = None
@@ -406,6 +444,9 @@ def query_string(
             pre_left, left = term(cursor, ab_term.left, context_path)
             pre_right, right = term(cursor, ab_term.right, context_path)
             pre = pre_left + " " + pre_right if pre_left and pre_right else pre_left if pre_left else pre_right
+            # and/or are commutative: evaluate the cheaper side first, so the expensive one is short-circuited
+            if filter_cost(ab_term.right, term_cost) < filter_cost(ab_term.left, term_cost):
+                left, right = right, left
             return pre, f"({left}) {ab_term.op} ({right})"
         else:
             raise AttributeError(f"Do not understand: {ab_term}")
@@ -6,9 +6,9 @@ from collections import defaultdict
 from datetime import datetime, timedelta
 
 from attrs import define, field, evolve
-from functools import reduce, partial, cached_property
+from functools import reduce, partial, cached_property, lru_cache
 from itertools import chain
-from typing import Mapping, Union, Optional, Any, ClassVar, Dict, List, Tuple, Callable, Set, Iterable
+from typing import Mapping, Union, Optional, Any, ClassVar, Dict, List, Tuple, Callable, Set, Iterable, Sequence
 
 from jsons import set_deserializer
 
@@ -23,6 +23,8 @@ from resotolib.durations import duration_str
 PathRoot = "/"
 
 
+# the same (section, name) pairs are resolved for every query
+@lru_cache(maxsize=4096)
 def variable_to_absolute(section: Optional[str], name: str) -> str:
     if name.startswith(PathRoot):
         return name[1:]
@@ -32,6 +34,7 @@ def variable_to_absolute(section: Optional[str], name: str) -> str:
         return name
 
 
+@lru_cache(maxsize=4096)
 def variable_to_relative(section: str, name: str) -> str:
     if name.startswith(PathRoot):
         return name
@@ -41,6 +44,11 @@ def variable_to_relative(section: str, name: str) -> str:
         return PathRoot + name
 
 
+def all_identical(left: Sequence[Any], right: Sequence[Any]) -> bool:
+    # used to detect, if change_variable has changed any element
+    return len(left) == len(right) and all(a is b for a, b in zip(left, right))
+
+
 def is_ancestor_descendant(name: str) -> bool:
     return name not in GraphResolver.resolved_property_names and (
         name.startswith("ancestors.") or name.startswith("descendants.")
@@ -203,8 +211,9 @@ class Term(abc.ABC):
     def __and__(self, other: Term) -> Term:
         return self.and_term(other)
 
-    def not_term(self) -> NotTerm:
-        return NotTerm(self)
+    def not_term(self) -> Term:
+        # not(not(x)) == x
+        return self.term if isinstance(self, NotTerm) else NotTerm(self)
 
     def combine(self, op: str, other: Term) -> Term:
         if op == "or":
@@ -218,11 +227,27 @@ class Term(abc.ABC):
     def is_all(self) -> bool:
         return isinstance(self, AllTerm)
 
+    @property
+    def has_ad(self) -> bool:
+        """
+        True, if this term contains a predicate on ancestors or descendants.
+        """
+        return False
+
+    @property
+    def ad_predicates(self) -> Tuple[Predicate, ...]:
+        """
+        All ancestor or descendant predicates of this term, that require a merge query.
+        """
+        return ()
+
     def or_term(self, other: Term) -> Term:
         if isinstance(self, AllTerm):  # all or x == all
             return self
         elif isinstance(other, AllTerm):  # x or all == all
             return other
+        elif self.has_operand("or", other):  # (x or y) or x == x or y
+            return self
         elif isinstance(self, MergeTerm):  # combining a merge term needs special handling
             return self.or_merge_term(other)
         elif isinstance(other, MergeTerm):  # combining a merge term needs special handling
@@ -235,6 +260,8 @@ class Term(abc.ABC):
             return other
         elif isinstance(other, AllTerm):  # x and all == x
             return self
+        elif self.has_operand("and", other):  # (x and y) and x == x and y
+            return self
         elif isinstance(self, MergeTerm):  # combining a merge term needs special handling
             return self.and_merge_term(other)
         elif isinstance(other, MergeTerm):  # combining a merge term needs special handling
@@ -242,21 +269,41 @@ class Term(abc.ABC):
         else:
             return CombinedTerm(self, "and", other)
 
+    def has_operand(self, op: str, other: Term) -> bool:
+        """
+        Cheap check if other is this term or one of its direct operands combined with the given operation.
+        Deeper operands of a chain are not considered: combining n terms one by one stays linear.
+        Python equality treats 1, 1.0 and True as equal: equal terms also need the same string representation.
+        """
+        candidates = (self.left, self.right) if isinstance(self, CombinedTerm) and self.op == op else (self,)
+        return any(term is other or (term == other and str(term) == str(other)) for term in candidates)
+
     def change_variable(self, fn: Callable[[str], str]) -> Term:
+        # a term is only created, if a variable has been changed: an unchanged term is returned as is
         def walk(term: Term) -> Term:
             if isinstance(term, CombinedTerm):
-                return CombinedTerm(walk(term.left), term.op, walk(term.right))
+                left = walk(term.left)
+                right = walk(term.right)
+                return term if left is term.left and right is term.right else CombinedTerm(left, term.op, right)
             if isinstance(term, ContextTerm):
-                return ContextTerm(fn(term.name), term.term)
+                name = fn(term.name)
+                return term if name == term.name else ContextTerm(name, term.term)
             elif isinstance(term, Predicate):
-                return Predicate(fn(term.name), term.op, term.value, term.args)
+                name = fn(term.name)
+                return term if name == term.name else Predicate(name, term.op, term.value, term.args)
             elif isinstance(term, FunctionTerm):
-                return FunctionTerm(term.fn, fn(term.property_path), term.args)
+                path = fn(term.property_path)
+                return term if path == term.property_path else FunctionTerm(term.fn, path, term.args)
             elif isinstance(term, MergeTerm):
+                pre = walk(term.pre_filter)
+                merge = [mq.change_variable(fn) for mq in term.merge]
                 post = walk(term.post_filter) if term.post_filter else None
-                return MergeTerm(walk(term.pre_filter), [mq.change_variable(fn) for mq in term.merge], post)
+                if pre is term.pre_filter and post is term.post_filter and all_identical(merge, term.merge):
+                    return term
+                return MergeTerm(pre, merge, post)
             elif isinstance(term, NotTerm):
-                return NotTerm(walk(term.term))
+                inner = walk(term.term)
+                return term if inner is term.term else NotTerm(inner)
             else:
                 return term
 
@@ -359,22 +406,23 @@ class Term(abc.ABC):
     # noinspection PyUnusedLocal
     @staticmethod
     def from_json(js: Dict[str, Any], _: type = object, **kwargs: Any) -> Term:
-        if isinstance(js.get("left"), dict) and isinstance(js.get("right"), dict) and isinstance(js.get("op"), str):
-            left = Term.from_json(js["left"])
-            right = Term.from_json(js["right"])
-            return CombinedTerm(left, js["op"], right)
-        elif isinstance(js.get("name"), str) and isinstance(js.get("op"), str):
-            args = js["args"] if isinstance(js.get("args"), dict) else {}
-            return Predicate(js["name"], js["op"], js["value"], args)
-        elif isinstance(js.get("name"), str) and isinstance(js.get("predicates"), list):
-            return ContextTerm(js["name"], js["predicates"])
-        elif isinstance(js.get("fn"), str) and isinstance(js.get("property_path"), str):
-            argv: list = js["args"] if isinstance(js.get("args"), list) else []  # type: ignore
-            return FunctionTerm(js["fn"], js["property_path"], argv)
-        elif isinstance(js.get("kind"), str):
-            return IsTerm(js["kind"])
-        elif isinstance(js.get("id"), str):
-            return IdTerm(js.get("id"))  # type: ignore
+        # look up every discriminator only once
+        get = js.get
+        op = get("op")
+        name = get("name")
+        args = get("args")
+        if isinstance(op, str) and isinstance(left := get("left"), dict) and isinstance(right := get("right"), dict):
+            return CombinedTerm(Term.from_json(left), op, Term.from_json(right))
+        elif isinstance(name, str) and isinstance(op, str):
+            return Predicate(name, op, js["value"], args if isinstance(args, dict) else {})
+        elif isinstance(name, str) and isinstance(predicates := get("predicates"), list):
+            return ContextTerm(name, predicates)  # type: ignore
+        elif isinstance(fn := get("fn"), str) and isinstance(property_path := get("property_path"), str):
+            return FunctionTerm(fn, property_path, args if isinstance(args, list) else [])
+        elif isinstance(kind := get("kind"), str):
+            return IsTerm(kind)  # type: ignore
+        elif isinstance(identifier := get("id"), str):
+            return IdTerm(identifier)  # type: ignore
         else:
             raise AttributeError(f"Can not parse json into query: {js}")
 
@@ -397,14 +445,30 @@ class NotTerm(Term):
     term: Term
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         return f"not({self.term})"
 
+    @cached_property
+    def has_ad(self) -> bool:
+        return self.term.has_ad
+
+    @cached_property
+    def ad_predicates(self) -> Tuple[Predicate, ...]:
+        return self.term.ad_predicates
+
 
 @define(order=True, hash=True, frozen=True)
 class FulltextTerm(Term):
     text: str
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         return f'"{self.text}"'
 
 
@@ -416,9 +480,21 @@ class Predicate(Term):
     args: Mapping[str, JsonElement]
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         modifier = f'{self.args["filter"]} ' if "filter" in self.args else ""
         return f"{self.name} {modifier}{self.op} {self.value_str_rep(self.value)}"
 
+    @cached_property
+    def has_ad(self) -> bool:
+        return is_ancestor_descendant(self.name)
+
+    @cached_property
+    def ad_predicates(self) -> Tuple[Predicate, ...]:
+        return (self,) if self.has_ad else ()
+
     @staticmethod
     def value_str_rep(value: Any) -> str:
         """
@@ -435,8 +511,17 @@ class ContextTerm(Term):
     term: Term
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         return f"{self.name}.{{{str(self.term)}}}"
 
+    # note: ad_predicates is not overridden, since predicates of a context term do not create merge queries
+    @cached_property
+    def has_ad(self) -> bool:
+        return self.term.has_ad
+
     def visible_predicates(self) -> List[Predicate]:
         """
         This method is not used to render a query, but to get a list of predicates that are visible in the query.
@@ -462,14 +547,30 @@ class CombinedTerm(Term):
     right: Term
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         return f"({self.left} {self.op} {self.right})"
 
+    @cached_property
+    def has_ad(self) -> bool:
+        return self.left.has_ad or self.right.has_ad
+
+    @cached_property
+    def ad_predicates(self) -> Tuple[Predicate, ...]:
+        return self.left.ad_predicates + self.right.ad_predicates
+
 
 @define(order=True, hash=True, frozen=True)
 class IdTerm(Term):
     ids: List[str]
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         id_string = ", ".join(f'"{a}"' for a in self.ids)
         ids = id_string if len(self.ids) == 1 else f"[{id_string}]"
         return f"id({ids})"
@@ -480,6 +581,10 @@ class IsTerm(Term):
     kinds: List[str]
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         kind_string = ", ".join(f'"{a}"' for a in self.kinds)
         kinds = kind_string if len(self.kinds) == 1 else f"[{kind_string}]"
         return f"is({kinds})"
@@ -492,6 +597,10 @@ class FunctionTerm(Term):
     args: List[Any]
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         args = ", ".join((Predicate.value_str_rep(a) for a in self.args))
         sep = ", " if args else ""
         return f"{self.fn}({self.property_path}{sep}{args})"
@@ -504,11 +613,17 @@ class MergeQuery:
     only_first: bool = True
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         arr = "" if self.only_first else "[]"
         return f"{self.name}{arr}: {self.query}"
 
     def change_variable(self, fn: Callable[[str], str]) -> MergeQuery:
-        return evolve(self, name=fn(self.name), query=self.query.change_variable(fn))
+        name = fn(self.name)
+        query = self.query.change_variable(fn)
+        return self if name == self.name and query is self.query else evolve(self, name=name, query=query)
 
 
 @define(order=True, hash=True, frozen=True)
@@ -538,10 +653,28 @@ class MergeTerm(Term):
             return evolve(self, pre_filter=self.pre_filter.and_term(other))
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         merge = ", ".join(str(q) for q in self.merge)
         post = " " + str(self.post_filter) if self.post_filter else ""
         return f"{self.pre_filter} {{{merge}}}{post}"
 
+    @cached_property
+    def has_ad(self) -> bool:
+        return (
+            self.pre_filter.has_ad
+            or (self.post_filter is not None and self.post_filter.has_ad)
+            or any(part.term.has_ad for mq in self.merge for part in mq.query.parts)
+        )
+
+    @cached_property
+    def ad_predicates(self) -> Tuple[Predicate, ...]:
+        post = self.post_filter.ad_predicates if self.post_filter else ()
+        merged = tuple(pred for mq in self.merge for part in mq.query.parts for pred in part.term.ad_predicates)
+        return self.pre_filter.ad_predicates + post + merged
+
 
 @define(order=True, hash=True, frozen=True)
 class Navigation:
@@ -559,6 +692,10 @@ class Navigation:
         return self.maybe_edge_types or [EdgeTypes.default]
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         start = self.start
         until = self.until
         until_str = "" if until == Navigation.Max else until
@@ -604,13 +741,17 @@ class WithClause:
     with_clause: Optional[WithClause] = None
 
     def change_variable(self, fn: Callable[[str], str]) -> WithClause:
-        return evolve(
-            self,
-            term=self.term.change_variable(fn) if self.term else None,
-            with_clause=self.with_clause.change_variable(fn) if self.with_clause else None,
-        )
+        term = self.term.change_variable(fn) if self.term else None
+        with_clause = self.with_clause.change_variable(fn) if self.with_clause else None
+        if term is self.term and with_clause is self.with_clause:
+            return self
+        return evolve(self, term=term, with_clause=with_clause)
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         term = " " + str(self.term) if self.term else ""
         with_clause = " " + str(self.with_clause) if self.with_clause else ""
         return f"with({self.with_filter}, {self.navigation}{term}{with_clause})"
@@ -661,6 +802,10 @@ class Part:
     reverse_result: bool = False
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         with_usage = f"{self.with_usage} " if self.with_usage is not None else ""
         with_clause = f" {self.with_clause}" if self.with_clause is not None else ""
         tag = f"#{self.tag}" if self.tag else ""
@@ -671,23 +816,22 @@ class Part:
         return f"{with_usage}{self.term}{with_clause}{tag}{sort}{limit}{reverse}{nav}"
 
     def change_variable(self, fn: Callable[[str], str]) -> Part:
-        return evolve(
-            self,
-            term=self.term.change_variable(fn),
-            with_clause=self.with_clause.change_variable(fn) if self.with_clause else None,
-            sort=[sort.change_variable(fn) for sort in self.sort],
-        )
+        term = self.term.change_variable(fn)
+        with_clause = self.with_clause.change_variable(fn) if self.with_clause else None
+        sort = [sort.change_variable(fn) for sort in self.sort]
+        if term is self.term and with_clause is self.with_clause and all_identical(sort, self.sort):
+            return self
+        return evolve(self, term=term, with_clause=with_clause, sort=sort)
 
     # ancestor.some_type.reported.prop -> MergeQuery
     def merge_queries_for(self, property_paths: Iterable[str]) -> List[MergeQuery]:
-        def with_query_for(property_path: str) -> MergeQuery:
+        def merge_name_for(property_path: str) -> Tuple[str, str]:
             try:
                 assert is_ancestor_descendant(property_path)
-                anc_dec, kind, _ = property_path.split(".", 2)
-                direction = Direction.inbound if anc_dec == "ancestors" else Direction.outbound
-                navigation = Navigation(1, Navigation.Max, direction=direction)
-                subquery = Query([Part(IsTerm([kind])), Part(AllTerm(), navigation=navigation)])
-                return MergeQuery(f"{anc_dec}.{kind}", subquery)
+                anc_dec, _, rest = property_path.partition(".")
+                kind, sep, _ = rest.partition(".")
+                assert sep, "path to the variable is missing"
+                return anc_dec, kind
             except Exception as ex:
                 raise AttributeError(
                     "The name of an ancestor variable has to follow the format: ancestors.<kind>.<path.to.variable>. "
@@ -696,10 +840,21 @@ class Part:
                     "Example: descendant..reported.name=test\n"
                 ) from ex
 
+        def with_query_for(anc_dec: str, kind: str) -> MergeQuery:
+            direction = Direction.inbound if anc_dec == "ancestors" else Direction.outbound
+            navigation = Navigation(1, Navigation.Max, direction=direction)
+            subquery = Query([Part(IsTerm([kind])), Part(AllTerm(), navigation=navigation)])
+            return MergeQuery(f"{anc_dec}.{kind}", subquery)
+
         existing = {a.name: a for a in (self.term.merge if isinstance(self.term, MergeTerm) else [])}
-        created = {a.name: a for a in [with_query_for(name) for name in property_paths]}
-        queries = list({**created, **existing}.values())
-        return queries
+        # single pass: a merge query is only created once per name, an existing merge query takes precedence
+        queries: Dict[str, MergeQuery] = {}
+        for path in property_paths:
+            anc_dec, kind = merge_name_for(path)
+            name = f"{anc_dec}.{kind}"
+            if name not in queries:
+                queries[name] = existing[name] if name in existing else with_query_for(anc_dec, kind)
+        return [*queries.values(), *(mq for name, mq in existing.items() if name not in queries)]
 
     def rewrite_for_ancestors_descendants(self) -> Part:
         """
@@ -722,27 +877,72 @@ class Part:
         :return: the rewritten part with resolved merge parts if ancestor or descendant predicates are found.
         """
 
-        def has_ancestor_descendant(t: Term) -> bool:
-            return t.find_term(lambda trm: isinstance(trm, Predicate) and is_ancestor_descendant(trm.name)) is not None
-
-        def ancestor_descendant_predicates(t: Term) -> List[Predicate]:
-            return t.find_terms(lambda t: isinstance(t, Predicate) and is_ancestor_descendant(t.name), in_context_term=False)  # type: ignore # noqa: E501
+        # Single walk over a term with ancestor/descendant predicates,
+        # that splits it into the terms to filter before and after the merge.
+        def visit(term: Term) -> Tuple[List[Term], List[Term]]:
+            if isinstance(term, CombinedTerm):
+                if term.op == "or":
+                    return [], [term]
+                elif term.left.has_ad and term.right.has_ad:
+                    left_before, left_after = visit(term.left)
+                    right_before, right_after = visit(term.right)
+                    return left_before + right_before, left_after + right_after
+                elif term.left.has_ad:
+                    before, after = visit(term.left)
+                    return [term.right, *before], after
+                else:
+                    before, after = visit(term.right)
+                    return [term.left, *before], after
+            elif isinstance(term, MergeTerm):
+                # in case pre- and post- filter are defined, handle it as AND combined term
+                # background: pre- and post- filter will be applied on the result
+                #             that effectively reflects an and combination.
+                #             The merge part only merges data to the existing values.
+                filter_term = (
+                    CombinedTerm(term.pre_filter, "and", term.post_filter) if term.post_filter else term.pre_filter
+                )
+                # the ancestor/descendant predicates might only be part of the merge queries
+                return visit(filter_term) if filter_term.has_ad else ([], [filter_term])
+            else:
+                return [], [term]
 
-        if has_ancestor_descendant(self.term):
+        if self.term.has_ad:
+            before, after = visit(self.term)
             # create a filter term that is independent of the merge and execute it before the merge
-            before_merge, after_merge = self.term.split_term_by(has_ancestor_descendant)
+            before_merge = reduce(lambda left, right: left & right, before, P.all())
+            after_merge = reduce(lambda left, right: left & right, after, P.all())
             # Create a dict here instead of a set only to ensure ordering (dict remembers order, set is not)'b
-            queries = self.merge_queries_for({p.name: 1 for p in ancestor_descendant_predicates(after_merge)})
+            queries = self.merge_queries_for({p.name: 1 for term in after for p in term.ad_predicates})
             return evolve(self, term=MergeTerm(before_merge, queries, after_merge))
         else:
             return self
 
-    @property
-    def visible_predicates(self) -> List[Predicate]:
-        result: List[Predicate] = self.term.find_terms(lambda x: isinstance(x, Predicate), in_context_term=False)  # type: ignore # noqa: E501
-        for ctx in self.term.find_terms(lambda x: isinstance(x, ContextTerm)):
-            result.extend(ctx.visible_predicates())  # type: ignore
-        return result
+    @cached_property
+    def visible_predicates(self) -> Tuple[Predicate, ...]:
+        # the result is cached: it is a tuple, so it can not be changed by the caller
+        result: List[Predicate] = []
+        contexts: List[ContextTerm] = []
+        # walk the term with an explicit stack: terms are pushed in reverse order to maintain the order of predicates
+        stack: List[Term] = [self.term]
+        while stack:
+            term = stack.pop()
+            if isinstance(term, Predicate):
+                result.append(term)
+            elif isinstance(term, ContextTerm):
+                contexts.append(term)
+            elif isinstance(term, CombinedTerm):
+                stack.append(term.right)
+                stack.append(term.left)
+            elif isinstance(term, NotTerm):
+                stack.append(term.term)
+            elif isinstance(term, MergeTerm):
+                stack.extend(reversed([p.term for mq in term.merge for p in mq.query.parts]))
+                if term.post_filter:
+                    stack.append(term.post_filter)
+                stack.append(term.pre_filter)
+        for ctx in contexts:
+            result.extend(ctx.visible_predicates())
+        return tuple(result)
 
 
 @define(order=True, hash=True, frozen=True)
@@ -753,7 +953,8 @@ class AggregateVariableName:
         return self.name
 
     def change_variable(self, fn: Callable[[str], str]) -> AggregateVariableName:
-        return AggregateVariableName(fn(self.name))
+        name = fn(self.name)
+        return self if name == self.name else AggregateVariableName(name)
 
 
 @define(order=True, hash=True, frozen=True)
@@ -765,9 +966,8 @@ class AggregateVariableCombined:
         return f'"{combined}"'
 
     def change_variable(self, fn: Callable[[str], str]) -> AggregateVariableCombined:
-        return AggregateVariableCombined(
-            [p.change_variable(fn) if isinstance(p, AggregateVariableName) else p for p in self.parts]
-        )
+        parts = [p.change_variable(fn) if isinstance(p, AggregateVariableName) else p for p in self.parts]
+        return self if all_identical(parts, self.parts) else AggregateVariableCombined(parts)
 
 
 @define(order=True, hash=True, frozen=True)
@@ -793,7 +993,8 @@ class AggregateVariable:
         return self.as_name if self.as_name else from_name()
 
     def change_variable(self, fn: Callable[[str], str]) -> AggregateVariable:
-        return evolve(self, name=self.name.change_variable(fn))
+        name = self.name.change_variable(fn)
+        return self if name is self.name else evolve(self, name=name)
 
     def property_paths(self) -> Set[str]:
         return set(self.all_names())
@@ -802,7 +1003,8 @@ class AggregateVariable:
 AggregateOp = Tuple[str, Union[int, float]]  # (operation, value or variable). e.g. ("+", 1) or ("-", "var1")
 
 
-@define(order=True, hash=True, frozen=True)
+# used as key to look up nested functions: the hash is computed only once
+@define(order=True, hash=True, frozen=True, cache_hash=True)
 class AggregateFunction:
     function: str
     name: Union[str, int]
@@ -821,7 +1023,9 @@ class AggregateFunction:
         return self.as_name if self.as_name else re.sub(r"\W+", "_", f"{self.function}_of_{self.name}")
 
     def change_variable(self, fn: Callable[[str], str]) -> AggregateFunction:
-        return evolve(self, name=fn(self.name)) if isinstance(self.name, str) else self
+        if isinstance(self.name, str) and (name := fn(self.name)) != self.name:
+            return evolve(self, name=name)
+        return self
 
     def property_paths(self) -> Set[str]:
         return {self.name} if isinstance(self.name, str) else set()
@@ -833,14 +1037,20 @@ class Aggregate:
     group_func: List[AggregateFunction]
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         grouped = ", ".join(str(a) for a in self.group_by) + ": " if self.group_by else ""
         funcs = ", ".join(str(a) for a in self.group_func)
         return f"aggregate({grouped}{funcs})"
 
     def change_variable(self, fn: Callable[[str], str]) -> Aggregate:
-        return Aggregate(
-            [a.change_variable(fn) for a in self.group_by], [a.change_variable(fn) for a in self.group_func]
-        )
+        group_by = [a.change_variable(fn) for a in self.group_by]
+        group_func = [a.change_variable(fn) for a in self.group_func]
+        if all_identical(group_by, self.group_by) and all_identical(group_func, self.group_func):
+            return self
+        return Aggregate(group_by, group_func)
 
     def property_paths(self) -> Set[str]:
         result = set()
@@ -877,13 +1087,14 @@ class Sort:
         return f"{self.name} {self.order}"
 
     def change_variable(self, fn: Callable[[str], str]) -> Sort:
-        return evolve(self, name=fn(self.name))
+        name = fn(self.name)
+        return self if name == self.name else evolve(self, name=name)
 
     def reversed(self) -> Sort:
         return Sort(self.name, SortOrder.Asc if self.order == SortOrder.Desc else SortOrder.Desc)
 
 
-@define(order=True, hash=True, frozen=True, slots=False)
+@define(order=True, hash=True, frozen=True)
 class Query:
     parts: List[Part]
     preamble: Dict[str, SimpleValue] = field(factory=dict)
@@ -901,6 +1112,10 @@ class Query:
         return Query([Part(res)], preamble if preamble else {})
 
     def __str__(self) -> str:
+        return self._str
+
+    @cached_property
+    def _str(self) -> str:
         aggregate = str(self.aggregate) if self.aggregate else ""
         to_str = Predicate.value_str_rep
         preamble = "(" + ", ".join(f"{k}={to_str(v)}" for k, v in self.preamble.items()) + ")" if self.preamble else ""
@@ -921,19 +1136,16 @@ class Query:
 
     def filter(self, term: Union[str, Term], *terms: Union[str, Term]) -> Query:
         res = Query.mk_term(term, *terms)
-        parts = self.parts.copy()
-        first_part = parts[0]
+        first_part = self.parts[0]
         if first_part.navigation is None:
             # just add the filter to this query
-            parts[0] = Part(CombinedTerm(first_part.term, "and", res))
+            return self.__with_first_part(Part(CombinedTerm(first_part.term, "and", res)))
         else:
             # put to the start
-            parts.insert(0, Part(res))
-        return evolve(self, parts=parts)
+            return self.__with_first_part(Part(res), insert=True)
 
     def filter_with(self, clause: WithClause) -> Query:
-        first_part = evolve(self.parts[0], with_clause=clause)
-        return evolve(self, parts=[first_part, *self.parts[1:]])
+        return self.__with_first_part(evolve(self.parts[0], with_clause=clause))
 
     def traverse_out(self, start: int = 1, until: int = 1, edge_type: EdgeType = EdgeTypes.default) -> Query:
         return self.traverse(start, until, edge_type, Direction.outbound)
@@ -947,20 +1159,21 @@ class Query:
     def traverse(
         self, start: int, until: int, edge_type: EdgeType = EdgeTypes.default, direction: str = Direction.outbound
     ) -> Query:
-        parts = self.parts.copy()
-        p0 = parts[0]
+        p0 = self.parts[0]
         if p0.navigation:
             # we already traverse in this direction: add start and until
             if edge_type in p0.navigation.edge_types and p0.navigation.direction == direction:
                 start_m = min(Navigation.Max, start + p0.navigation.start)
                 until_m = min(Navigation.Max, until + p0.navigation.until)
-                parts[0] = evolve(p0, navigation=evolve(p0.navigation, start=start_m, until=until_m))
+                return self.__with_first_part(
+                    evolve(p0, navigation=evolve(p0.navigation, start=start_m, until=until_m))
+                )
             # this is another traversal: so we need to start a new part
             else:
-                parts.insert(0, Part(AllTerm(), navigation=Navigation(start, until, [edge_type], direction)))
+                navigation = Navigation(start, until, [edge_type], direction)
+                return self.__with_first_part(Part(AllTerm(), navigation=navigation), insert=True)
         else:
-            parts[0] = evolve(p0, navigation=Navigation(start, until, [edge_type], direction))
-        return evolve(self, parts=parts)
+            return self.__with_first_part(evolve(p0, navigation=Navigation(start, until, [edge_type], direction)))
 
     def group_by(self, variables: List[AggregateVariable], funcs: List[AggregateFunction]) -> Query:
         aggregate = Aggregate(variables, funcs)
@@ -981,20 +1194,20 @@ class Query:
         return evolve(self, preamble=updated)
 
     def merge_with(self, path: str, navigation: Navigation, term: Term) -> Query:
-        parts = self.parts.copy()
-        first_part = parts[0]
+        first_part = self.parts[0]
         merge = MergeQuery(path, Query([Part(term), Part(AllTerm(), navigation=navigation)]))
         term = (
             evolve(first_part.term, merge=[*first_part.term.merge, merge])
             if isinstance(first_part.term, MergeTerm)
             else MergeTerm(first_part.term, [merge])
         )
-        parts[0] = evolve(first_part, term=term)
-        return evolve(self, parts=parts)
+        return self.__with_first_part(evolve(first_part, term=term))
 
     def change_variable(self, fn: Callable[[str], str]) -> Query:
         aggregate = self.aggregate.change_variable(fn) if self.aggregate else None
         parts = [p.change_variable(fn) for p in self.parts]
+        if aggregate is self.aggregate and all_identical(parts, self.parts):
+            return self
         return evolve(self, aggregate=aggregate, parts=parts)
 
     def rewrite_for_ancestors_descendants(self, additional_paths_to_select: Optional[Iterable[str]] = None) -> Query:
@@ -1034,14 +1247,19 @@ class Query:
         return self.parts[0]
 
     def __change_current_part(self, fn: Callable[[Part], Part]) -> Query:
-        parts = self.parts.copy()
         # if navigation is defined: the current part is already defined to the end
-        if parts[0].navigation:
-            part = Part(AllTerm())
-            parts.insert(0, part)
+        if self.parts[0].navigation:
+            return self.__with_first_part(fn(Part(AllTerm())), insert=True)
         else:
-            part = parts[0]
-        parts[0] = fn(part)
+            return self.__with_first_part(fn(self.parts[0]))
+
+    def __with_first_part(self, part: Part, insert: bool = False) -> Query:
+        # create the parts list in one go: either replace the first part or put the new part to the start
+        if insert:
+            parts = [part, *self.parts]
+        else:
+            parts = self.parts.copy()
+            parts[0] = part
         return evolve(self, parts=parts)
 
     def combine(self, other: Query) -> Query:
@@ -1066,35 +1284,44 @@ class Query:
             tag = left_last.tag if left_last.tag else right_first.tag
             with_clause = left_last.with_clause if left_last.with_clause else right_first.with_clause
             with_usage = left_last.with_usage if left_last.with_usage else right_first.with_usage
-            sort = combine_optional(left_last.sort, right_first.sort, lambda m, r: m + r)
+            sort = left_last.sort + right_first.sort
             limit = combine_optional(left_last.limit, right_first.limit, combine_limit)
-            combined = Part(term, tag, with_clause, with_usage, sort if sort else [], limit, right_first.navigation)
+            combined = Part(term, tag, with_clause, with_usage, sort, limit, right_first.navigation)
             parts = [*other.parts[0:-1], combined, *self.parts[1:]]
         return Query(parts, preamble, aggregate)
 
-    @property
-    def visible_predicates(self) -> List[Predicate]:
+    @cached_property
+    def visible_predicates(self) -> Tuple[Predicate, ...]:
         """
-        Returns a list of all predicates in this query.
+        Returns all predicates in this query.
         """
-        return [pred for part in self.parts for pred in part.visible_predicates]
+        return tuple(pred for part in self.parts for pred in part.visible_predicates)
 
     def find_terms(self, fn: Callable[[Term], bool], **kwargs: bool) -> List[Term]:
         return [t for p in self.parts for t in p.term.find_terms(fn, **kwargs)]
 
     def analytics(self) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        # the analytics of an immutable query do not change: hand out copies of the cached result
+        counters, names = self._analytics
+        return dict(counters), {name: list(values) for name, values in names.items()}
+
+    @cached_property
+    def _analytics(self) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
         counters: Dict[str, int] = defaultdict(lambda: 0)
         names: Dict[str, List[str]] = defaultdict(list)
 
-        def term_analytics(term: Term) -> None:
-            name = type(term).__name__
-            counters[f"term_{name.lower()}"] += 1
-            if isinstance(term, Predicate):
-                counters[f"op_{term.op}"] += 1
-                names["predicate_names"].append(term.name)
-            elif isinstance(term, CombinedTerm):
-                term_analytics(term.left)
-                term_analytics(term.right)
+        def term_analytics(root: Term) -> None:
+            # walk the term with an explicit stack: right is pushed before left to maintain the order
+            stack = [root]
+            while stack:
+                term = stack.pop()
+                counters[f"term_{type(term).__name__.lower()}"] += 1
+                if isinstance(term, Predicate):
+                    counters[f"op_{term.op}"] += 1
+                    names["predicate_names"].append(term.name)
+                elif isinstance(term, CombinedTerm):
+                    stack.append(term.right)
+                    stack.append(term.left)
 
         def with_clause_analytics(clause: WithClause) -> None:
             counters["with_clause"] += 1
@@ -1168,11 +1395,12 @@ class Query:
             else:
                 raise AttributeError(f"Expected term or string, but got {t}")
 
-        term_in = list(args)
-        term_in.insert(0, term)
-        terms = map(make_term, term_in)
-        # noinspection PyTypeChecker
-        return reduce(lambda left, right: CombinedTerm(left, "and", right), terms)
+        terms = [make_term(t) for t in (term, *args)]
+        # combine pairwise: the resulting tree has a depth of log(n) instead of n
+        while len(terms) > 1:
+            paired: List[Term] = [CombinedTerm(left, "and", right) for left, right in zip(terms[0::2], terms[1::2])]
+            terms = paired + terms[-1:] if len(terms) % 2 else paired
+        return terms[0]
 
     def structure(self) -> Json:
         """
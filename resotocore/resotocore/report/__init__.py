@@ -11,7 +11,7 @@ from attr import define, field, evolve
 from resotocore.ids import ConfigId, GraphName
 from resotocore.model.typed_model import to_js
 from resotocore.types import Json
-from resotocore.util import uuid_str, if_set, partition_by
+from resotocore.util import uuid_str, if_set
 
 log = logging.getLogger(__name__)
 
@@ -253,16 +253,16 @@ class CheckCollectionResult:
         )
 
     def passing_failing_checks_for_account(self, account: str) -> Tuple[List[CheckResult], List[CheckResult]]:
-        passing_child_checks, failing_child_checks = reduce(
-            lambda pf, el: (pf[0] + el[0], pf[1] + el[1]),
-            [c.passing_failing_checks_for_account(account) for c in self.children],
-            (cast(List[CheckResult], []), cast(List[CheckResult], [])),
-        )
-
-        failing_checks, passing_checks = partition_by(
-            lambda c: account in c.number_of_resources_failing_by_account, self.checks
-        )
-        return passing_checks + passing_child_checks, failing_checks + failing_child_checks
+        # single pre-order walk: checks of a collection come before the checks of its children
+        passing: List[CheckResult] = []
+        failing: List[CheckResult] = []
+        todo: List[CheckCollectionResult] = [self]
+        while todo:
+            collection = todo.pop()
+            for check in collection.checks:
+                (failing if account in check.number_of_resources_failing_by_account else passing).append(check)
+            todo.extend(reversed(collection.children))
+        return passing, failing
 
     def passing_failing_checks_count_for_account(self, account: str) -> Tuple[int, int]:
         passing, failing = reduce(
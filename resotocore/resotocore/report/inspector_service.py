@@ -1,10 +1,11 @@
+import asyncio
+import json
 import logging
+import re
 from collections import defaultdict
 from functools import lru_cache
-from typing import Optional, List, Dict, Tuple, Callable, AsyncIterator, cast
+from typing import Optional, List, Dict, Tuple, Callable, AsyncIterator, Any
 
-from aiostream import stream, pipe
-from aiostream.core import Stream
 from attr import define
 from resotocore.analytics import CoreEvent
 from resotocore.cli import list_sink
@@ -38,13 +39,26 @@ from resotocore.report import (
 from resotocore.report.report_config import ReportCheckCollectionConfig, BenchmarkConfig, ReportConfig
 from resotocore.service import Service
 from resotocore.types import Json
-from resotocore.util import value_in_path, uuid_str, value_in_path_get
-from resotolib.json_bender import Bender, S, bend
+from resotocore.util import value_in_path, uuid_str
 
 log = logging.getLogger(__name__)
 
 SingleCheckResult = Dict[str, List[Json]]
 
+# identifiers in a search or command: used to find the result kinds of a check
+identifier_re = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+# severity priorities are computed once, so severity checks are plain integer comparisons
+severity_prio: Dict[ReportSeverity, int] = {s: s.prio() for s in ReportSeverity if s is not ReportSeverity.kind}
+
+
+@lru_cache(maxsize=None)
+def severities_including(severity: ReportSeverity) -> Tuple[ReportSeverity, ...]:
+    # all severities that are at least as severe as the given one
+    # note: the kind class variable is an enum member as well, but does not define a severity
+    return tuple(s for s in ReportSeverity if s is not ReportSeverity.kind and severity.prio() <= s.prio())
+
 
 @define
 class CheckContext:
@@ -54,32 +68,54 @@ class CheckContext:
     parallel_checks: int = 10
 
     def severities_including(self, severity: ReportSeverity) -> List[ReportSeverity]:
-        return [s for s in ReportSeverity if self.includes_severity(severity)]
+        return list(severities_including(severity))
 
     def includes_severity(self, severity: ReportSeverity) -> bool:
         if self.severity is None:
             return True
         else:
-            return self.severity.prio() <= severity.prio()
-
-
-# This defines the subset of the data provided for every resource
-ReportResourceData: Dict[str, Bender] = {
-    "node_id": S("id"),
-    "id": S("reported", "id"),
-    "name": S("reported", "name"),
-    "kind": S("reported", "kind"),
-    "tags": S("reported", "tags"),
-    "ctime": S("reported", "ctime"),
-    "atime": S("reported", "atime"),
-    "mtime": S("reported", "mtime"),
-    "cloud": S("ancestors", "cloud", "reported", "name"),
-    "account": S("ancestors", "account", "reported", "name"),
-    "region": S("ancestors", "region", "reported", "name"),
-    "zone": S("ancestors", "zone", "reported", "name"),
+            return severity_prio[self.severity] <= severity_prio[severity]
+
+
+# This defines the subset of the data provided for every resource: name -> path in the resource
+ReportResourceData: Dict[str, Tuple[str, ...]] = {
+    "node_id": ("id",),
+    "id": ("reported", "id"),
+    "name": ("reported", "name"),
+    "kind": ("reported", "kind"),
+    "tags": ("reported", "tags"),
+    "ctime": ("reported", "ctime"),
+    "atime": ("reported", "atime"),
+    "mtime": ("reported", "mtime"),
+    "cloud": ("ancestors", "cloud", "reported", "name"),
+    "account": ("ancestors", "account", "reported", "name"),
+    "region": ("ancestors", "region", "reported", "name"),
+    "zone": ("ancestors", "zone", "reported", "name"),
 }
 
 
+def account_id_of(resource: Json) -> Optional[str]:
+    # called for every resource: the path ancestors.account.reported.id is fixed, so access it directly
+    try:
+        return resource["ancestors"]["account"]["reported"]["id"]  # type: ignore
+    except (KeyError, TypeError):
+        return None
+
+
+def report_resource_data(resource: Json) -> Json:
+    # called for every failing resource: a plain lookup of all paths, a missing path yields None
+    result: Json = {}
+    for name, path in ReportResourceData.items():
+        value: Any = resource
+        try:
+            for key in path:
+                value = value[key]
+        except (KeyError, TypeError, IndexError):
+            value = None
+        result[name] = value
+    return result
+
+
 class InspectorService(Inspector, Service):
     def __init__(self, cli: CLI) -> None:
         super().__init__()
@@ -137,11 +173,9 @@ class InspectorService(Inspector, Service):
         return await self.report_check_db.update(check)
 
     async def __benchmarks(self, names: List[str]) -> Dict[str, Benchmark]:
-        result: Dict[str, Benchmark] = {}
-        for name in names:
-            if b := await self.benchmark(name):
-                result[name] = b
-        return result
+        # lookup all benchmarks concurrently
+        found = await asyncio.gather(*(self.benchmark(name) for name in names))
+        return {name: b for name, b in zip(names, found) if b is not None}
 
     async def list_checks(
         self,
@@ -154,18 +188,30 @@ class InspectorService(Inspector, Service):
         context: Optional[CheckContext] = None,
         ignore_checks: Optional[List[str]] = None,
     ) -> List[ReportCheck]:
+        # only test the filters that are defined: typically only one or two are
+        predicates: List[Callable[[ReportCheck], bool]] = []
+        if check_ids is not None:
+            check_id_set = set(check_ids)
+            predicates.append(lambda inspection: inspection.id in check_id_set)
+        if provider is not None:
+            predicates.append(lambda inspection: inspection.provider == provider)
+        if service is not None:
+            predicates.append(lambda inspection: inspection.service == service)
+        if category is not None:
+            predicates.append(lambda inspection: category in inspection.categories)
+        if kind is not None:
+            predicates.append(lambda inspection: kind in inspection.result_kinds)
+        if context is not None and context.severity is not None:  # without severity, all checks are included
+            severity_context = context
+            predicates.append(lambda inspection: severity_context.includes_severity(inspection.severity))
+        if ignore_checks is not None:
+            ignore_check_set = set(ignore_checks)
+            predicates.append(lambda inspection: inspection.id not in ignore_check_set)
+
         def inspection_matches(inspection: ReportCheck) -> bool:
-            return (
-                (provider is None or provider == inspection.provider)
-                and (service is None or service == inspection.service)
-                and (category is None or category in inspection.categories)
-                and (kind is None or kind in inspection.result_kinds)
-                and (check_ids is None or inspection.id in check_ids)
-                and (context is None or context.includes_severity(inspection.severity))
-                and (ignore_checks is None or inspection.id not in ignore_checks)
-            )
+            return all(predicate(inspection) for predicate in predicates)
 
-        return await self.filter_checks(inspection_matches)
+        return await self.filter_checks(inspection_matches if predicates else None)
 
     async def load_benchmarks(
         self,
@@ -179,16 +225,17 @@ class InspectorService(Inspector, Service):
         context = CheckContext(accounts=accounts, severity=severity, only_failed=only_failing)
         config = await self.report_config()
         # create query
-        term: Term = P("benchmarks[]").is_in(benchmark_names)
+        issue_term: Term = P("benchmarks[]").is_in(benchmark_names)
         # TODO: 17.01.2024: remove the next line after deployed on prd
-        term = term.or_term(P("benchmark").is_in(benchmark_names))
+        issue_term = issue_term.or_term(P("benchmark").is_in(benchmark_names))
         if severity:
-            term = term & P("severity").is_in([s.value for s in context.severities_including(severity)])
-        term = P.context("security.issues[]", term)
+            issue_term = issue_term & P("severity").is_in([s.value for s in context.severities_including(severity)])
+        # all terms are and-combined in one step
+        terms: List[Term] = [P.context("security.issues[]", issue_term)]
         if accounts:
-            term = term & P("ancestors.account.reported.id").is_in(accounts)
-        term = term & P("security.has_issues").eq(True)
-        model = QueryModel(Query.by(term), await self.model_handler.load_model(graph))
+            terms.append(P("ancestors.account.reported.id").is_in(accounts))
+        terms.append(P("security.has_issues").eq(True))
+        model = QueryModel(Query.by(*terms), await self.model_handler.load_model(graph))
 
         # collect all checks
         benchmarks = await self.__benchmarks(benchmark_names)
@@ -197,14 +244,20 @@ class InspectorService(Inspector, Service):
         check_lookup = {check.id: check for check in checks}
 
         # perform query, map resources and create lookup map
-        check_results: Dict[str, SingleCheckResult] = defaultdict(lambda: defaultdict(list))
+        resources: Dict[Tuple[str, str], List[Json]] = defaultdict(list)
         async with await self.db_access.get_graph_db(graph).search_list(model) as cursor:
             async for entry in cursor:
-                if account_id := value_in_path(entry, NodePath.ancestor_account_id):
-                    mapped = bend(ReportResourceData, entry)
-                    for issue in value_in_path_get(entry, NodePath.security_issues, cast(List[Json], [])):
-                        if check := issue.get("check"):
-                            check_results[check][account_id].append(mapped)
+                if account_id := account_id_of(entry):
+                    issues: List[Json] = (entry.get("security") or {}).get("issues") or []
+                    # only map the resource, if it has an issue of a check that is part of the result
+                    if checks_found := [check for issue in issues if (check := issue.get("check")) in check_lookup]:
+                        mapped = report_resource_data(entry)
+                        for check in checks_found:
+                            resources[(check, account_id)].append(mapped)
+        # group the resources by check and account
+        check_results: Dict[str, SingleCheckResult] = defaultdict(dict)
+        for (check_id, account_id), failing in resources.items():
+            check_results[check_id][account_id] = failing
         return {
             name: self.__to_result(benchmark, check_lookup, check_results, context)
             for name, benchmark in benchmarks.items()
@@ -228,13 +281,14 @@ class InspectorService(Inspector, Service):
         check_ids = {check for b in benchmarks.values() for check in b.nested_checks() if config.check_allowed(check)}
         checks = await self.list_checks(check_ids=list(check_ids), context=context)
         check_lookup = {check.id: check for check in checks}
+        # the model is loaded once and shared by all checks and the security section sync
+        model = await self.model_handler.load_model(graph)
         # create benchmark results
-        results = await self.__perform_checks(graph, checks, context, config)
+        results = await self.__perform_checks(graph, model, checks, context, config)
         result = {
             name: self.__to_result(benchmark, check_lookup, results, context) for name, benchmark in benchmarks.items()
         }
         if sync_security_section:
-            model = await self.model_handler.load_model(graph)
             # In case no run_id is provided, we invent a report run id here.
             run_id = report_run_id or uuid_str()
             await self.db_access.get_graph_db(graph).update_security_section(
@@ -283,12 +337,13 @@ class InspectorService(Inspector, Service):
             children=[],
         )
 
+        model = await self.model_handler.load_model(graph)
         if context.accounts is None:
-            context.accounts = await self.__list_accounts(benchmark, graph)
+            context.accounts = await self.__list_accounts(benchmark, graph, model)
 
-        checks_to_perform = await self.list_checks(check_ids=benchmark.nested_checks(), context=context)
-        check_by_id = {c.id: c for c in checks_to_perform}
-        results = await self.__perform_checks(graph, checks_to_perform, context, config)
+        # the benchmark consists of exactly the checks listed above: no need to list them again
+        check_by_id = {c.id: c for c in checks}
+        results = await self.__perform_checks(graph, model, checks, context, config)
         await self.event_sender.core_event(CoreEvent.BenchmarkPerformed, {"benchmark": benchmark.id})
         return self.__to_result(benchmark, check_by_id, results, context)
 
@@ -365,19 +420,32 @@ class InspectorService(Inspector, Service):
         results: Dict[str, SingleCheckResult],
         context: CheckContext,
     ) -> BenchmarkResult:
-        def to_result(cc: CheckCollection) -> CheckCollectionResult:
+        def to_result(cc: CheckCollection, children: List[CheckCollectionResult]) -> CheckCollectionResult:
             check_results = []
             for cid in cc.checks or []:
                 if (check := check_by_id.get(cid)) is not None:
                     result = results.get(cid, {})
                     count_by_account = {uid: len(failed) for uid, failed in result.items()}
                     check_results.append(CheckResult(check, count_by_account, result))
-            children = [to_result(c) for c in cc.children or []]
             return CheckCollectionResult(
                 cc.title, cc.description, documentation=cc.documentation, checks=check_results, children=children
             )
 
-        top = to_result(benchmark).filter_result(context.only_failed)
+        # post-order walk without recursion: a collection is built once all of its children are built
+        todo: List[Tuple[CheckCollection, bool]] = [(benchmark, False)]
+        done: List[CheckCollectionResult] = []
+        while todo:
+            cc, children_done = todo.pop()
+            if children_done:
+                num_children = len(cc.children or [])
+                children = done[len(done) - num_children :]
+                del done[len(done) - num_children :]
+                done.append(to_result(cc, children))
+            else:
+                todo.append((cc, True))
+                todo.extend((child, False) for child in reversed(cc.children or []))
+
+        top = done[0].filter_result(context.only_failed)
         return BenchmarkResult(
             benchmark.title,
             benchmark.description,
@@ -392,33 +460,47 @@ class InspectorService(Inspector, Service):
             id=benchmark.id,
         )
 
-    async def __perform_checks(  # type: ignore
-        self, graph: GraphName, checks: List[ReportCheck], context: CheckContext, config: ReportConfig
+    async def __perform_checks(
+        self,
+        graph: GraphName,
+        model: Model,
+        checks: List[ReportCheck],
+        context: CheckContext,
+        config: ReportConfig,
     ) -> Dict[str, SingleCheckResult]:
-        # load model
-        model = await self.model_handler.load_model(graph)
-
-        async def perform_single(check: ReportCheck) -> Tuple[str, SingleCheckResult]:
-            return check.id, await self.__perform_check(graph, model, check, config, context)
-
-        check_results: Stream[Tuple[str, SingleCheckResult]] = stream.iterate(checks) | pipe.map(
-            perform_single, ordered=False, task_limit=context.parallel_checks  # type: ignore
-        )
-        async with check_results.stream() as streamer:
-            return {key: value async for key, value in streamer}
+        # checks with the same detection and environment find the same resources: perform them only once
+        checks_by_detection: Dict[str, List[ReportCheck]] = defaultdict(list)
+        for check in checks:
+            env = check.environment(config.override_values)
+            detection = json.dumps([check.detect, env], sort_keys=True, default=str)
+            checks_by_detection[detection].append(check)
+
+        # limit the number of checks performed in parallel
+        semaphore = asyncio.Semaphore(context.parallel_checks)
+
+        async def perform_single(same: List[ReportCheck]) -> Tuple[List[ReportCheck], SingleCheckResult]:
+            async with semaphore:
+                return same, await self.__perform_check(graph, model, same[0], config, context)
+
+        check_results = await asyncio.gather(*(perform_single(same) for same in checks_by_detection.values()))
+        result: Dict[str, SingleCheckResult] = {}
+        for same, value in check_results:
+            result[same[0].id] = value
+            # checks sharing a detection get their own copy: the result of one check can be changed independently
+            for check in same[1:]:
+                result[check.id] = {account: list(resources) for account, resources in value.items()}
+        return result
 
     async def __perform_check(
         self, graph: GraphName, model: Model, inspection: ReportCheck, config: ReportConfig, context: CheckContext
     ) -> SingleCheckResult:
         resources_by_account = defaultdict(list)
         async for resource in await self.__list_failing_resources(graph, model, inspection, config, context):
-            account_id = value_in_path(resource, NodePath.ancestor_account_id)
-            if account_id:
-                resources_by_account[account_id].append(bend(ReportResourceData, resource))
+            if account_id := account_id_of(resource):
+                resources_by_account[account_id].append(report_resource_data(resource))
         return resources_by_account
 
-    async def __list_accounts(self, benchmark: Benchmark, graph: GraphName) -> List[str]:
-        model = await self.model_handler.load_model(graph)
+    async def __list_accounts(self, benchmark: Benchmark, graph: GraphName, model: Model) -> List[str]:
         gdb = self.db_access.get_graph_db(graph)
         query = Query.by("account")
         if benchmark.clouds:
@@ -449,7 +531,9 @@ class InspectorService(Inspector, Service):
         return {"errors": errors} if errors else None
 
     async def __validate_benchmark(self, benchmark: Benchmark) -> List[str]:
-        all_checks = {c.id for c in await self.filter_checks()}
+        # only the ids are required: predefined checks are loaded once, stored checks are not parsed
+        all_checks = set(checks_from_file())
+        all_checks.update([cid async for cid in self.report_check_db.keys()])
         errors = []
         for check in benchmark.nested_checks():
             if check not in all_checks:
@@ -473,8 +557,9 @@ class InspectorService(Inspector, Service):
                 errors.append(f"Check {check.id} neither has a resoto, resoto_cmd or manual defined")
             if not check.result_kinds:
                 errors.append(f"Check {check.id} does not define any result kind")
+            detect_identifiers = set(identifier_re.findall(detect))
             for rk in check.result_kinds:
-                if rk not in detect:
+                if rk not in detect_identifiers:
                     errors.append(f"Check {check.id} does not detect result kind {rk}")
             if not check.remediation.text:
                 errors.append(f"Check {check.id} does not define any remediation text")
@@ -492,19 +577,18 @@ class InspectorService(Inspector, Service):
     ) -> AsyncIterator[Tuple[NodeId, List[SecurityIssue]]]:
         # Create a mapping from node_id to all check results that contain this node
         node_result: Dict[str, List[Tuple[BenchmarkResult, CheckResult]]] = defaultdict(list)
-
-        def walk_collection(collection: CheckCollectionResult, parent: BenchmarkResult) -> None:
+        # walk all collections depth first with an explicit stack: pushed in reverse order to keep the order
+        stack: List[Tuple[CheckCollectionResult, BenchmarkResult]] = [(r, r) for r in reversed(results.values())]
+        while stack:
+            collection, parent = stack.pop()
             for check in collection.checks:
                 for resources in check.resources_failing_by_account.values():
                     for resource in resources:
                         node_result[resource["node_id"]].append((parent, check))
-            for child in collection.children:
-                walk_collection(child, parent)
-
-        for result in results.values():
-            walk_collection(result, result)
+            stack.extend((child, parent) for child in reversed(collection.children))
 
         async def iterate_nodes() -> AsyncIterator[Tuple[NodeId, List[SecurityIssue]]]:
+            # note: security issues can not be shared between nodes, since they are changed while updating a node
             for node_id, contexts in node_result.items():
                 issues = [
                     SecurityIssue(check=check.check.id, severity=check.check.severity, benchmarks={bench.id})
@@ -652,8 +652,7 @@ async def inspector_service(
     cli: CLIService, benchmark: Benchmark, inspection_checks: List[ReportCheck]
 ) -> InspectorService:
     async with InspectorService(cli) as service:
-        for check in inspection_checks:
-            await service.update_check(check)
+        await asyncio.gather(*(service.update_check(check) for check in inspection_checks))
         await service.update_benchmark(benchmark)
         cli.dependencies.lookup["inspector"] = service
         return service
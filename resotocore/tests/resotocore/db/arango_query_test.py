@@ -1,4 +1,5 @@
 from datetime import timedelta, datetime
+from typing import Tuple
 
 import pytest
 
@@ -9,6 +10,7 @@ from resotocore.db.model import QueryModel
 from resotocore.model.model import Model
 from resotocore.query.model import Query, Sort, P
 from resotocore.query.query_parser import parse_query, predicate_term
+from resotocore.types import Json
 
 
 def test_sort_order_for_synthetic_prop(foo_model: Model, graph_db: GraphDB) -> None:
@@ -54,6 +56,32 @@ def test_id_term(foo_model: Model, graph_db: GraphDB) -> None:
     assert "m0.id in @b0" in q
 
 
+def test_filter_cost_order(foo_model: Model, graph_db: GraphDB) -> None:
+    def filter_of(query: str) -> Tuple[str, Json]:
+        query_str, bind_vars = to_query(graph_db, QueryModel(parse_query(query), foo_model))
+        return query_str[query_str.index("FILTER") : query_str.index("RETURN")].strip(), bind_vars  # noqa: E203
+
+    regex = "(m0.name!=null and REGEX_TEST(m0.name, @b0, true))"
+    # the cheaper predicate is evaluated first, independent of the order in the query
+    assert filter_of('name=~"foo" and some_int==1') == (
+        f"FILTER (m0.some_int == @b1) and ({regex})",
+        {"b0": "foo", "b1": 1},
+    )
+    assert filter_of('name=~"foo" or some_int==1') == (
+        f"FILTER (m0.some_int == @b1) or ({regex})",
+        {"b0": "foo", "b1": 1},
+    )
+    # the cost of a combined term is defined by its most expensive side
+    assert filter_of('name=~"foo" or (some_int==1 and identifier!="a")') == (
+        f"FILTER ((m0.some_int == @b1) and (m0.identifier != @b2)) or ({regex})",
+        {"b0": "foo", "b1": 1, "b2": "a"},
+    )
+    # already ordered terms are not changed
+    assert filter_of('some_int==1 and name=~"foo"')[0] == (
+        "FILTER (m0.some_int == @b0) and ((m0.name!=null and REGEX_TEST(m0.name, @b1, true)))"
+    )
+
+
 def test_fulltext_term() -> None:
     part = parse_query('(a>0 and ("foo" and (b>1 and c>2 and "d")))').parts[0]
     ft, remaining = fulltext_term_combine(part.term)
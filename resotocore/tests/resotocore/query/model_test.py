@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from hypothesis import given, settings, HealthCheck
 
@@ -19,6 +21,8 @@ from resotocore.query.model import (
     NotTerm,
     FunctionTerm,
     Limit,
+    Term,
+    CombinedTerm,
 )
 from resotocore.query.query_parser import parse_query
 from tests.resotocore.query import query
@@ -83,6 +87,41 @@ def test_simplify() -> None:
     # also works in nested setup
     q = Query.by(AllTerm() & ((P("test") == True) & (IsTerm(["test"]) | AllTerm())))
     assert (str(q)) == "test == true"
+    # x and x => x, x or x => x: also if x is already part of the combined term
+    assert str((P("a") == 1) & (P("b") == 2) & (P("a") == 1)) == "(a == 1 and b == 2)"
+    assert str((P("a") == 1) | (P("b") == 2) | (P("b") == 2)) == "(a == 1 or b == 2)"
+    assert str(((P("a") == 1) | (P("b") == 2)) & (P("a") == 1)) == "((a == 1 or b == 2) and a == 1)"
+    # not(not(x)) => x
+    assert str(IsTerm(["test"]).not_term().not_term()) == 'is("test")'
+
+
+def test_combine_long_chain() -> None:
+    def operands(term: Term) -> int:
+        count = 1
+        while isinstance(term, CombinedTerm):
+            count += 1
+            term = term.left
+        return count
+
+    # only the direct operands are checked for duplicates: combining many terms one by one stays cheap
+    term: Term = P("a0") == 0
+    for i in range(1, 3000):
+        term = term & (P(f"a{i}") == i) & (P(f"a{i}") == i)
+    assert operands(term) == 3000
+    assert (term & (P("a2999") == 2999)) is term
+    # a duplicate deeper in the chain is kept
+    assert operands(term & (P("a0") == 0)) == 3001
+
+
+def test_combine_keeps_different_value_types() -> None:
+    # 1 == True == 1.0 in python, but these are different predicates
+    for a, b in [(1, True), (0, False), (1, 1.0), ([1], [True])]:
+        assert str((P("a") == a) & (P("a") == b)) == f"(a == {json.dumps(a)} and a == {json.dumps(b)})"
+        assert str((P("a") == a) | (P("a") == b)) == f"(a == {json.dumps(a)} or a == {json.dumps(b)})"
+    # identical terms are still combined
+    assert str((P("a") == 1) & (P("a") == 1)) == "a == 1"
+    query = "(a==1 and b==2) and (a==true and ancestors.foo.reported.name==x)"
+    assert "a == true" in str(parse_query(query).rewrite_for_ancestors_descendants())
 
 
 def test_combine() -> None:
@@ -153,6 +192,8 @@ def test_on_section() -> None:
     assert str(with_section_r.on_section(PathRoot)) == on_section
     # a query relative to section root does not change the query
     assert str(with_section_r.relative_to_section(PathRoot)) == on_section
+    # changing no variable does not create a new query
+    assert with_section_r.change_variable(lambda x: x) is with_section_r
 
 
 def test_rewrite_usage() -> None:
@@ -294,10 +335,31 @@ def test_term_contains() -> None:
     assert term.contains_term_type(FunctionTerm) is False
 
 
+def test_ancestor_descendant_predicates() -> None:
+    term = (
+        parse_query("a>1 and not(ancestors.foo.reported.x>1) and (b<2 or descendants.bla.reported.y==3)").parts[0].term
+    )
+    assert term.has_ad is True
+    assert [p.name for p in term.ad_predicates] == ["ancestors.foo.reported.x", "descendants.bla.reported.y"]
+    assert parse_query("a>1 and b<2").parts[0].term.has_ad is False
+    # predicates inside a context term do not create merge queries
+    assert parse_query("a.{ancestors.foo.reported.x>1}").parts[0].term.ad_predicates == ()
+    # predicates of merge queries are found as well
+    merge = parse_query("a>1 {bla: <-- ancestors.foo.reported.x>1}").parts[0]
+    assert merge.term.has_ad is True
+    assert [p.name for p in merge.term.ad_predicates] == ["ancestors.foo.reported.x"]
+    # the merge query itself does not create an additional merge query in the outer query
+    rewritten = merge.rewrite_for_ancestors_descendants()
+    assert str(rewritten) == "all {bla: all <-default- ancestors.foo.reported.x > 1} a > 1"
+
+
 def test_context_predicates() -> None:
     query: Query = parse_query("a.b[*].{ a=2 and b[1].bla=3 and c.d[*].{ e=4 and f=5 } }")
     expected = ["a.b[*].a", "a.b[*].b[1].bla", "a.b[*].c.d[*].e", "a.b[*].c.d[*].f"]
     assert [str(a.name) for a in query.visible_predicates] == expected
+    # the cached predicates can not be changed by the caller
+    assert isinstance(query.visible_predicates, tuple)
+    assert isinstance(query.parts[0].visible_predicates, tuple)
 
 
 def test_merge_term_combination() -> None:
@@ -330,6 +392,14 @@ def test_merge_term_combination() -> None:
     assert str(sq1 & mq1) == '(is("foo") and age > "23h") {bla: all -default-> is("bla")} bla.test == 2'
 
 
+def test_str_cached() -> None:
+    q = Query.by(P.of_kind("foo") & (P("a") == 1)).traverse_out()
+    # the string representation is only computed once
+    assert str(q) is str(q)
+    # a changed copy does not share the cached string
+    assert str(q.with_limit(10)) == str(q) + " all limit 10"
+
+
 @given(query)
 @settings(max_examples=200, suppress_health_check=list(HealthCheck))
 def test_generated_query(q: Query) -> None:
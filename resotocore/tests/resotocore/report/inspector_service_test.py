@@ -1,25 +1,30 @@
-from typing import Dict, List
+import asyncio
+from typing import Dict, List, Optional
 
+from attrs import evolve
 from pytest import fixture
 from resotocore.cli.cli import CLIService
 from resotocore.config import ConfigEntity
 from resotocore.db.model import QueryModel
 from resotocore.ids import ConfigId, GraphName
-from resotocore.query.model import P, Query
+from resotocore.query.model import P, Query, Aggregate, AggregateFunction
 from resotocore.report import (
     BenchmarkConfigRoot,
     CheckConfigRoot,
     BenchmarkResult,
     Benchmark,
+    CheckCollectionResult,
+    CheckResult,
     ReportCheck,
+    ReportSeverity,
 )
-from resotocore.report.inspector_service import InspectorService
+from resotocore.report.inspector_service import InspectorService, CheckContext
 from resotocore.report.report_config import (
     config_model,
     ReportCheckCollectionConfig,
     BenchmarkConfig,
 )
-from resotocore.util import partition_by
+from resotocore.types import Json
 
 
 @fixture
@@ -27,8 +32,7 @@ async def inspector_service_with_test_benchmark(
     cli: CLIService, inspection_checks: List[ReportCheck], benchmark: Benchmark
 ) -> InspectorService:
     service = InspectorService(cli)
-    for check in inspection_checks:
-        await service.update_check(check)
+    await asyncio.gather(*(service.update_check(check) for check in inspection_checks))
     await service.update_benchmark(benchmark)
     return service
 
@@ -38,6 +42,12 @@ async def test_config_model() -> None:
     assert len(models) == 7
 
 
+def test_severities_including() -> None:
+    context = CheckContext(severity=ReportSeverity.high)
+    assert context.severities_including(ReportSeverity.high) == [ReportSeverity.high, ReportSeverity.critical]
+    assert len(context.severities_including(ReportSeverity.info)) == 5
+
+
 async def test_list_inspect_checks(inspector_service: InspectorService) -> None:
     # list all available checks
     all_checks = {i.id: i for i in await inspector_service.list_checks()}
@@ -51,10 +61,11 @@ async def test_list_inspect_checks(inspector_service: InspectorService) -> None:
         kind="aws_ec2_instance",
         check_ids=["aws_ec2_internet_facing_with_instance_profile"],
     )
+    args = {}
     last_len = len(all_checks)
-    for options in range(1, len(filter_options)):
-        args = dict(list(filter_options.items())[0:options])
-        matching_checks = [i for i in await inspector_service.list_checks(**args)]  # type: ignore
+    for name, value in list(filter_options.items())[:-1]:
+        args[name] = value
+        matching_checks = await inspector_service.list_checks(**args)  # type: ignore
         assert len(matching_checks) > 0
         assert len(matching_checks) <= last_len
         last_len = len(matching_checks)
@@ -83,12 +94,16 @@ async def test_perform_benchmark(inspector_service: InspectorService) -> None:
     assert_result(performed)
 
     # make sure the result is persisted as part of the node
+    db = inspector_service.db_access.get_graph_db(graph_name)
+    model = await inspector_service.model_handler.load_model(graph_name)
+
     async def count_vulnerable() -> int:
-        db = inspector_service.db_access.get_graph_db(graph_name)
-        model = await inspector_service.model_handler.load_model(graph_name)
+        # only count the resources: aggregate instead of fetching all of them
         all_vunerable = Query.by(P("security.has_issues") == True)  # noqa
-        async with await db.search_list(QueryModel(all_vunerable, model), with_count=True) as cursor:
-            return cursor.count()  # type: ignore
+        count = evolve(all_vunerable, aggregate=Aggregate([], [AggregateFunction("sum", 1, (), "count")]))
+        async with await db.search_aggregation(QueryModel(count, model)) as cursor:
+            counted = [entry async for entry in cursor]
+            return counted[0]["count"] if counted else 0
 
     assert await count_vulnerable() == 10
 
@@ -98,47 +113,98 @@ async def test_perform_benchmark(inspector_service: InspectorService) -> None:
 
 
 async def test_benchmark_node_result(inspector_service: InspectorService) -> None:
-    results = await inspector_service.perform_benchmarks(inspector_service.cli.env["graph"], ["test"])
+    graph_name = GraphName(inspector_service.cli.env["graph"])
+    results = await inspector_service.perform_benchmarks(graph_name, ["test"])
     result = results["test"]
     node_edge_list = result.to_graph()
-    nodes, edges = partition_by(lambda x: x["type"] == "node", node_edge_list)
+    nodes: List[Json] = []
+    edges: List[Json] = []
+    for elem in node_edge_list:
+        (nodes if elem["type"] == "node" else edges).append(elem)
     assert len(node_edge_list) == 9  # 1 benchmark, 2 collections, 2 checks, 4 edges
     assert len(nodes) == 5
     assert len(edges) == 4
 
 
+def test_passing_failing_checks_for_account(inspection_checks: List[ReportCheck]) -> None:
+    def check(name: str, *failing_accounts: str) -> CheckResult:
+        failing = {account: [{"id": f"{name}_{account}"}] for account in failing_accounts}
+        return CheckResult(evolve(inspection_checks[0], id=name), {account: 1 for account in failing_accounts}, failing)
+
+    def ids(checks: List[CheckResult]) -> List[str]:
+        return [c.check.id for c in checks]
+
+    # nested tree: checks on every level, collections with and without checks
+    result = CheckCollectionResult(
+        "root",
+        "root",
+        checks=[check("r1", "a"), check("r2")],
+        children=[
+            CheckCollectionResult(
+                "c1",
+                "c1",
+                checks=[check("c1_1", "a", "b")],
+                children=[
+                    CheckCollectionResult("c1_1", "c1_1", checks=[check("c1_1_1", "b"), check("c1_1_2", "a")]),
+                    CheckCollectionResult("c1_2", "c1_2"),
+                ],
+            ),
+            CheckCollectionResult(
+                "c2", "c2", children=[CheckCollectionResult("c2_1", "c2_1", checks=[check("c2_1_1")])]
+            ),
+        ],
+    )
+    # checks of a collection come before the checks of its children
+    passing, failing = result.passing_failing_checks_for_account("a")
+    assert ids(passing) == ["r2", "c1_1_1", "c2_1_1"]
+    assert ids(failing) == ["r1", "c1_1", "c1_1_2"]
+    passing, failing = result.passing_failing_checks_for_account("b")
+    assert ids(passing) == ["r1", "r2", "c1_1_2", "c2_1_1"]
+    assert ids(failing) == ["c1_1", "c1_1_1"]
+    passing, failing = result.passing_failing_checks_for_account("does_not_exist")
+    assert ids(passing) == ["r1", "r2", "c1_1", "c1_1_1", "c1_1_2", "c2_1_1"]
+    assert failing == []
+    # the counts are consistent with the checks
+    for account in ["a", "b", "does_not_exist"]:
+        passing, failing = result.passing_failing_checks_for_account(account)
+        assert result.passing_failing_checks_count_for_account(account) == (len(passing), len(failing))
+
+
 async def test_predefined_checks(inspector_service: InspectorService) -> None:
     checks = ReportCheckCollectionConfig.from_files()
     assert len(checks) > 0
-    for name, check in checks.items():
-        validation = await inspector_service.validate_check_collection_config({CheckConfigRoot: check})
+    validations = await asyncio.gather(
+        *(inspector_service.validate_check_collection_config({CheckConfigRoot: check}) for check in checks.values())
+    )
+    for validation in validations:
         assert validation is None, str(validation)
 
 
 async def test_predefined_benchmarks(inspector_service: InspectorService) -> None:
     benchmarks = BenchmarkConfig.from_files()
     assert len(benchmarks) > 0
-    for name, check in benchmarks.items():
-        config = {BenchmarkConfigRoot: check}
-        cfg_id = ConfigId(name)
-        validation = await inspector_service.validate_benchmark_config(cfg_id, config)
-        assert validation is None, f"Benchmark: {name}" + str(validation)
+    configs = {ConfigId(name): {BenchmarkConfigRoot: check} for name, check in benchmarks.items()}
+    validations = await asyncio.gather(
+        *(inspector_service.validate_benchmark_config(cfg_id, config) for cfg_id, config in configs.items())
+    )
+    for (cfg_id, config), validation in zip(configs.items(), validations):
+        assert validation is None, f"Benchmark: {cfg_id}" + str(validation)
         benchmark = BenchmarkConfig.from_config(ConfigEntity(cfg_id, config))
         assert benchmark.clouds == ["aws"]
 
 
 async def test_list_failing(inspector_service: InspectorService) -> None:
-    graph = inspector_service.cli.env["graph"]
-    search_res = [r async for r in await inspector_service.list_failing_resources(graph, "test_test_search")]
-    assert len(search_res) == 10
-    cmd_res = [r async for r in await inspector_service.list_failing_resources(graph, "test_test_cmd")]
-    assert len(cmd_res) == 10
-    search_res_account = [
-        r async for r in await inspector_service.list_failing_resources(graph, "test_test_search", ["n/a"])
-    ]
-    assert len(search_res_account) == 0
-    cmd_res_account = [r async for r in await inspector_service.list_failing_resources(graph, "test_test_cmd", ["n/a"])]
-    assert len(cmd_res_account) == 0
+    async def count_failing(check_id: str, account_ids: Optional[List[str]] = None) -> int:
+        count = 0
+        async for _ in await inspector_service.list_failing_resources(graph_name, check_id, account_ids):
+            count += 1
+        return count
+
+    graph_name = GraphName(inspector_service.cli.env["graph"])
+    assert await count_failing("test_test_search") == 10
+    assert await count_failing("test_test_cmd") == 10
+    assert await count_failing("test_test_search", ["n/a"]) == 0
+    assert await count_failing("test_test_cmd", ["n/a"]) == 0
 
 
 async def test_file_inspector(inspector_service: InspectorService) -> None:
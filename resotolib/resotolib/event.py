@@ -1,11 +1,14 @@
+import atexit
 import os
 import time
-from collections import defaultdict
+from logging import DEBUG
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from enum import Enum
-from threading import Thread, Lock
-from typing import Callable, Iterable, Any, Dict
+from queue import Empty, SimpleQueue
+from threading import Lock, Semaphore, Thread, current_thread, local
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
 
-from resotolib.lock import RWLock
+from resotolib.args import ArgumentParser
 from resotolib.logger import log
 from resotolib.types import Json
 
@@ -40,6 +43,27 @@ class EventType(Enum):
     GENERATE_METRICS = "generate_metrics"
 
 
+# Prefix of the thread name of a listener, that is called on a thread of its own for an event of this type.
+_EVENT_PREFIX: Mapping[EventType, str] = {event_type: f"{event_type.name.lower()}_event-" for event_type in EventType}
+
+
+def add_args(arg_parser: ArgumentParser) -> None:
+    arg_parser.add_argument(
+        "--event-workers",
+        help="Number of threads running event listeners (default: min(32, number of CPUs + 4))",
+        default=min(32, (os.cpu_count() or 1) + 4),
+        dest="event_workers",
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--event-min-wait",
+        help="Minimum time in seconds to wait for a blocking event listener (default: 0)",
+        default=0,
+        dest="event_min_wait",
+        type=float,
+    )
+
+
 class Event:
     """An Event"""
 
@@ -48,67 +72,278 @@ class Event:
         self.data = data
 
 
-_events: Dict[EventType, Dict[Callable[[Event], None], Any]] = defaultdict(dict)
-_events_lock = RWLock()
+class _Listeners(NamedTuple):
+    """The listeners of one event type as parallel tuples - position i of every tuple belongs to the same listener"""
+
+    listeners: Tuple[Callable[[Event], None], ...] = ()
+    blocking: Tuple[bool, ...] = ()
+    timeouts: Tuple[int, ...] = ()
+    one_shot: Tuple[bool, ...] = ()
+    locks: Tuple[Lock, ...] = ()
+    pids: Tuple[int, ...] = ()
+    names: Tuple[str, ...] = ()
+
+    def add(self, listener: Callable[[Event], None], blocking: bool, timeout: int, one_shot: bool) -> "_Listeners":
+        return _Listeners(
+            self.listeners + (listener,),
+            self.blocking + (blocking,),
+            self.timeouts + (timeout,),
+            self.one_shot + (one_shot,),
+            self.locks + (Lock(),),
+            self.pids + (os.getpid(),),
+            self.names + (getattr(listener, "__name__", "anonymous"),),
+        )
+
+    def remove(self, listener: Callable[[Event], None]) -> "_Listeners":
+        idx = self.listeners.index(listener)
+        return _Listeners(*(column[:idx] + column[idx + 1 :] for column in self))  # type: ignore
+
+
+# Copy-on-write registry: readers access _events without any locking. Writers hold _events_lock,
+# build an updated copy and rebind _events. Neither the mapping nor its values are mutated in place.
+_events: Mapping[EventType, _Listeners] = {}
+_events_lock = Lock()
+
+
+class _ListenerPool:
+    """Runs event listeners on worker threads that persist across dispatches
+
+    A new worker is started, up to max_workers, whenever no idle worker is available.
+    The workers are daemon threads: idle workers must neither keep the process alive nor block code
+    that joins all non-daemon threads, like cherrypy's engine.block(). Instead, the pool is shut down
+    at exit and waits for the running listeners, as the process did for the non-daemon threads formerly
+    started for every listener call. Once shut down, the pool stays closed and does not accept new calls.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max(1, max_workers)
+        self.calls: "SimpleQueue[Optional[Tuple[Future[None], Callable[[Event], None], Event]]]" = SimpleQueue()
+        self.idle = Semaphore(0)
+        self.workers: List[Thread] = []
+        self.lock = Lock()
+        self.is_shutdown = False
+
+    def submit(self, listener: Callable[[Event], None], event: Event) -> "Future[None]":
+        future: Future[None] = Future()
+        with self.lock:
+            if self.is_shutdown:
+                raise RuntimeError("Event listener pool is shut down")
+            self.calls.put((future, listener, event))
+        if not self.idle.acquire(blocking=False):
+            with self.lock:
+                if len(self.workers) < self.max_workers and not self.is_shutdown:
+                    worker = Thread(target=self.__work, name=f"event_{len(self.workers) + 1}", daemon=True)
+                    self.workers.append(worker)
+                    worker.start()
+        return future
+
+    def shutdown(self, wait: bool) -> None:
+        """Stop all workers, once the listener calls submitted so far are done"""
+        with self.lock:
+            if not self.is_shutdown:
+                self.is_shutdown = True
+                for _ in self.workers:
+                    self.calls.put(None)
+            workers = list(self.workers)
+        if wait:
+            for worker in workers:
+                if worker is not current_thread():
+                    worker.join()
+
+    def __work(self) -> None:
+        _listener_thread.active = True
+        while (call := self.calls.get()) is not None:
+            future, listener, event = call
+            if future.set_running_or_notify_cancel():
+                try:
+                    listener(event)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(None)
+            self.idle.release()
+
+
+# Listeners are run by a pool of worker threads that persists across dispatches.
+# The pool is created lazily and recreated in forked child processes. It is shut down by the SHUTDOWN event
+# and at exit. Once shut down, the pool stays closed: events dispatched afterwards are dropped.
+_executor: Optional[_ListenerPool] = None
+_executor_pid: Optional[int] = None
+_executor_lock = Lock()
+
+# Marks the worker threads of the pool: a listener that waits for the listeners of another event
+# would block a worker, while these listeners wait for a free worker.
+_listener_thread = local()
+
+
+def _get_executor() -> _ListenerPool:
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            max_workers = getattr(ArgumentParser.args, "event_workers", None) or min(32, (os.cpu_count() or 1) + 4)
+            _executor = _ListenerPool(max_workers)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _shutdown_executor(wait: bool) -> None:
+    """Stop accepting new listener calls - already submitted listeners are still run"""
+    _get_executor().shutdown(wait)
+
+
+atexit.register(_shutdown_executor, True)
+
+
+def _start_listener_thread(listener: Callable[[Event], None], event: Event, name: str) -> "Future[None]":
+    """Call the listener on a thread of its own and report the outcome as future"""
+    future: Future[None] = Future()
+
+    def run() -> None:
+        if future.set_running_or_notify_cancel():
+            try:
+                listener(event)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+    Thread(target=run, name=name).start()
+    return future
+
+
+# Events that do not need to be waited for are put on a queue and dispatched by a background thread.
+# Like the executor, queue and thread are created lazily and recreated in forked child processes.
+_event_queue: Optional["SimpleQueue[Event]"] = None
+_event_queue_pid: Optional[int] = None
+_event_queue_lock = Lock()
+
+
+def _get_event_queue() -> "SimpleQueue[Event]":
+    global _event_queue, _event_queue_pid
+    with _event_queue_lock:
+        if _event_queue is None or _event_queue_pid != os.getpid():
+            _event_queue = SimpleQueue()
+            _event_queue_pid = os.getpid()
+            Thread(target=_dispatch_queued_events, args=(_event_queue,), name="event_dispatcher", daemon=True).start()
+        return _event_queue
+
+
+def _dispatch_queued_events(queue: "SimpleQueue[Event]") -> None:
+    while True:
+        # Block until there is work, then drain everything queued in the meantime in one go.
+        batch = [queue.get()]
+        try:
+            while True:
+                batch.append(queue.get_nowait())
+        except Empty:
+            pass
+        for event in batch:
+            try:
+                # Look up the listeners per event: one-shot listeners are removed by the previous dispatch.
+                _do_dispatch(event, _events.get(event.event_type, _Listeners()), False)
+            except Exception:
+                log.exception(f"Caught unhandled exception while dispatching event {event.event_type.name}")
+
+
+def _log_listener_exception(future: Future[None]) -> None:
+    if not future.cancelled() and (exception := future.exception()) is not None:
+        log.error("Caught unhandled event callback exception", exc_info=exception)
 
 
 def event_listener_registered(event_type: EventType, listener: Callable[[Event], None]) -> bool:
     """Return whether listener is registered to event"""
-    if _events is None:
-        return False
-    return event_type in _events.keys() and listener in _events[event_type].keys()
+    listeners = _events.get(event_type)
+    return listeners is not None and listener in listeners.listeners
 
 
 def dispatch_event(event: Event, blocking: bool = False) -> None:
-    """Dispatch an Event"""
-    waiting_str = "" if blocking else "not "
-    log.debug(f"Dispatching event {event.event_type.name} and {waiting_str}waiting for" " listeners to return")
+    """Dispatch an Event
 
-    if event.event_type not in _events.keys():
+    If neither the caller nor any listener wants to wait, the event is queued and dispatched
+    by a background thread. Otherwise, and for SHUTDOWN events, which usually precede
+    the exit of the process, listeners are called from the current thread.
+    Events dispatched after the SHUTDOWN event are dropped.
+    """
+    if log.isEnabledFor(DEBUG):
+        waiting_str = "" if blocking else "not "
+        log.debug(f"Dispatching event {event.event_type.name} and {waiting_str}waiting for" " listeners to return")
+
+    # Read the registry only once: _events might be rebound by another thread at any time, e.g. by
+    # listeners that unregister themselves. The listeners themselves are never changed in place,
+    # so no copy is required while processing the current event.
+    listeners = _events.get(event.event_type)
+    if listeners is None:
+        if event.event_type == EventType.SHUTDOWN:
+            _shutdown_executor(wait=False)
         return
 
-    with _events_lock.read_access:
-        # Event listeners might unregister themselves during event dispatch
-        # so we will work on a shallow copy while processing the current event.
-        listeners = dict(_events[event.event_type])
+    if blocking or event.event_type == EventType.SHUTDOWN or any(listeners.blocking):
+        _do_dispatch(event, listeners, blocking)
+    else:
+        _get_event_queue().put(event)
+
 
-    threads = {}
-    for listener, listener_data in listeners.items():
+def _do_dispatch(event: Event, listeners: _Listeners, blocking: bool) -> None:
+    debug = log.isEnabledFor(DEBUG)
+    executor = _get_executor()
+    if executor.is_shutdown:
+        log.debug(f"Event {event.event_type.name} dispatched after shutdown - dropping it")
+        return
+    pid = os.getpid()
+    min_wait = getattr(ArgumentParser.args, "event_min_wait", None) or 0
+    # Only collect futures if there is anything to wait for: future -> (listener name, absolute deadline)
+    pending: Optional[Dict[Future[None], Tuple[str, float]]] = {} if blocking or any(listeners.blocking) else None
+    # A listener waiting for other listeners would block a worker of the pool, until none is left to run them.
+    # Listeners to wait for get a thread of their own instead, so their timeout is still enforced.
+    nested = pending is not None and getattr(_listener_thread, "active", False)
+    for listener, listener_blocking, timeout, one_shot, lock, listener_pid, name in zip(*listeners):
         try:
-            if listener_data["pid"] != os.getpid():
+            if listener_pid != pid:
                 continue
 
-            if listener_data["one-shot"] and not listener_data["lock"].acquire(blocking=False):
+            if one_shot and not lock.acquire(blocking=False):
                 log.error(f"Not calling one-shot listener {listener} of type" f" {type(listener)} - can't acquire lock")
                 continue
 
-            log.debug(
-                f"Calling listener {listener} of type {type(listener)}" f" (blocking: {listener_data['blocking']})"
-            )
-            thread_name = f"{event.event_type.name.lower()}_event" f"-{getattr(listener, '__name__', 'anonymous')}"
-            t = Thread(target=listener, args=[event], name=thread_name)
-            if blocking or listener_data["blocking"]:
-                threads[t] = listener
-            t.start()
+            if debug:
+                log.debug(f"Calling listener {listener} of type {type(listener)}" f" (blocking: {listener_blocking})")
+            if nested and (blocking or listener_blocking):
+                future = _start_listener_thread(listener, event, _EVENT_PREFIX[event.event_type] + name)
+            else:
+                future = executor.submit(listener, event)
+            future.add_done_callback(_log_listener_exception)
+            if pending is not None and (blocking or listener_blocking):
+                pending[future] = (name, time.monotonic() + max(timeout, min_wait))
         except Exception:
             log.exception("Caught unhandled event callback exception")
         finally:
-            if listener_data["one-shot"]:
-                log.debug(
-                    f"One-shot specified for event {event.event_type.name} "
-                    f"listener {listener} - removing event listener"
-                )
+            if one_shot:
+                if debug:
+                    log.debug(
+                        f"One-shot specified for event {event.event_type.name} "
+                        f"listener {listener} - removing event listener"
+                    )
                 remove_event_listener(event.event_type, listener)
-                listener_data["lock"].release()
+                lock.release()
+
+    if event.event_type == EventType.SHUTDOWN:
+        _shutdown_executor(wait=False)
 
-    start_time = time.time()
-    for thread, listener in threads.items():
-        timeout = start_time + listeners[listener]["timeout"] - time.time()
-        if timeout < 1:
-            timeout = 1
-        log.debug(f"Waiting up to {timeout:.2f}s for event listener {thread.name} to finish")
-        thread.join(timeout)
-        log.debug(f"Event listener {thread.name} finished (timeout: {thread.is_alive()})")
+    # Wake up whenever a listener finishes or the next listener timeout expires.
+    while pending:
+        timeout = max(min(deadline for _, deadline in pending.values()) - time.monotonic(), 0)
+        if debug:
+            log.debug(f"Waiting up to {timeout:.2f}s for {len(pending)} event listeners to finish")
+        done, _ = wait(pending, timeout, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for future, (name, deadline) in list(pending.items()):
+            if future in done or deadline <= now:
+                del pending[future]
+                if debug:
+                    log.debug(
+                        f"Event listener {name} of event {event.event_type.name} finished"
+                        f" (timeout: {future not in done})"
+                    )
 
 
 def add_event_listener(
@@ -123,38 +358,36 @@ def add_event_listener(
         log.error(f"Error registering {listener} of type {type(listener)} with event" f" {event_type.name}")
         return False
 
-    log.debug(f"Registering {listener} with event {event_type.name}" f" (blocking: {blocking}, one-shot: {one_shot})")
-    with _events_lock.write_access:
+    if log.isEnabledFor(DEBUG):
+        log.debug(
+            f"Registering {listener} with event {event_type.name}" f" (blocking: {blocking}, one-shot: {one_shot})"
+        )
+    global _events
+    with _events_lock:
         if not event_listener_registered(event_type, listener):
-            _events[event_type][listener] = {
-                "blocking": blocking,
-                "timeout": timeout,
-                "one-shot": one_shot,
-                "lock": Lock(),
-                "pid": os.getpid(),
-            }
+            listeners = _events.get(event_type, _Listeners()).add(listener, blocking, timeout, one_shot)
+            _events = {**_events, event_type: listeners}
             return True
         return False
 
 
 def remove_event_listener(event_type: EventType, listener: Callable[[Event], None]) -> bool:
     """Remove an Event Listener"""
-    with _events_lock.write_access:
+    global _events
+    with _events_lock:
         if event_listener_registered(event_type, listener):
-            log.debug(f"Removing {listener} from event {event_type.name}")
-            del _events[event_type][listener]
-            if len(_events[event_type]) == 0:
-                del _events[event_type]
+            if log.isEnabledFor(DEBUG):
+                log.debug(f"Removing {listener} from event {event_type.name}")
+            listeners = _events[event_type].remove(listener)
+            if listeners.listeners:
+                _events = {**_events, event_type: listeners}
+            else:
+                _events = {k: v for k, v in _events.items() if k != event_type}
             return True
         return False
 
 
 def list_event_listeners() -> Iterable[str]:
-    with _events_lock.read_access:
-        for event_type, listeners in _events.items():
-            for listener, listener_data in listeners.items():
-                yield (
-                    f"{event_type.name}: {listener}, "
-                    f"blocking: {listener_data['blocking']}, "
-                    f"one-shot: {listener_data['one-shot']}"
-                )
+    for event_type, listeners in _events.items():
+        for listener, blocking, one_shot in zip(listeners.listeners, listeners.blocking, listeners.one_shot):
+            yield f"{event_type.name}: {listener}, blocking: {blocking}, one-shot: {one_shot}"
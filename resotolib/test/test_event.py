@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from typing import List
+
+from pytest import fixture, MonkeyPatch
+
+from resotolib import event as event_module
+from resotolib.event import (
+    _ListenerPool,
+    Event,
+    EventType,
+    add_event_listener,
+    dispatch_event,
+    event_listener_registered,
+    list_event_listeners,
+    remove_event_listener,
+)
+
+
+def test_blocking_dispatch() -> None:
+    called: List[str] = []
+    daemon: List[bool] = []
+
+    def listener(event: Event) -> None:
+        time.sleep(0.1)
+        called.append(threading.current_thread().name)
+        daemon.append(threading.current_thread().daemon)
+
+    assert add_event_listener(EventType.PROCESS_BEGIN, listener)
+    assert not add_event_listener(EventType.PROCESS_BEGIN, listener)
+    assert event_listener_registered(EventType.PROCESS_BEGIN, listener)
+    assert f"PROCESS_BEGIN: {listener}, blocking: False, one-shot: False" in list_event_listeners()
+    try:
+        dispatch_event(Event(EventType.PROCESS_BEGIN, {}), blocking=True)
+        assert len(called) == 1
+        assert called[0].startswith("event")
+        # idle workers never keep the process alive: running listeners are waited for at exit
+        assert daemon == [True]
+        dispatch_event(Event(EventType.PROCESS_BEGIN, {}), blocking=True)
+        assert len(called) == 2
+    finally:
+        assert remove_event_listener(EventType.PROCESS_BEGIN, listener)
+    assert not event_listener_registered(EventType.PROCESS_BEGIN, listener)
+
+
+def test_non_blocking_dispatch() -> None:
+    done = threading.Event()
+
+    def listener(event: Event) -> None:
+        assert event.data == {"foo": "bar"}
+        done.set()
+
+    add_event_listener(EventType.PROCESS_FINISH, listener)
+    try:
+        dispatch_event(Event(EventType.PROCESS_FINISH, {"foo": "bar"}))
+        assert done.wait(5)
+    finally:
+        remove_event_listener(EventType.PROCESS_FINISH, listener)
+
+
+def test_one_shot_and_timeout() -> None:
+    called: List[int] = []
+    release = threading.Event()
+
+    def one_shot(event: Event) -> None:
+        called.append(1)
+
+    def slow(event: Event) -> None:
+        release.wait(5)
+
+    add_event_listener(EventType.GENERATE_METRICS, one_shot, blocking=True, one_shot=True)
+    add_event_listener(EventType.GENERATE_METRICS, slow, blocking=True, timeout=0)
+    try:
+        start = time.monotonic()
+        dispatch_event(Event(EventType.GENERATE_METRICS, {}))
+        # the slow listener is not waited for longer than its timeout
+        assert time.monotonic() - start < 1
+        assert called == [1]
+        assert not event_listener_registered(EventType.GENERATE_METRICS, one_shot)
+        dispatch_event(Event(EventType.GENERATE_METRICS, {}))
+        assert called == [1]
+    finally:
+        release.set()
+        remove_event_listener(EventType.GENERATE_METRICS, slow)
+
+
+def test_queued_dispatch_burst() -> None:
+    called: List[int] = []
+    one_shot_called: List[int] = []
+    all_done = threading.Event()
+
+    def listener(event: Event) -> None:
+        called.append(event.data["n"])
+        if len(called) == 100:
+            all_done.set()
+
+    def one_shot(event: Event) -> None:
+        one_shot_called.append(event.data["n"])
+
+    add_event_listener(EventType.CLEANUP_PLAN, listener)
+    add_event_listener(EventType.CLEANUP_PLAN, one_shot, one_shot=True)
+    try:
+        for n in range(100):
+            dispatch_event(Event(EventType.CLEANUP_PLAN, {"n": n}))
+        assert all_done.wait(5)
+        assert sorted(called) == list(range(100))
+        # the one-shot listener is only called for the first event, even if events are drained in batches
+        assert one_shot_called == [0]
+    finally:
+        remove_event_listener(EventType.CLEANUP_PLAN, listener)
+
+
+@fixture
+def single_worker_pool(monkeypatch: MonkeyPatch) -> _ListenerPool:
+    pool = _ListenerPool(1)
+    monkeypatch.setattr(event_module, "_executor", pool)
+    monkeypatch.setattr(event_module, "_executor_pid", os.getpid())
+    return pool
+
+
+def test_nested_blocking_dispatch(single_worker_pool: _ListenerPool) -> None:
+    called: List[str] = []
+    release = threading.Event()
+
+    def inner(event: Event) -> None:
+        called.append(threading.current_thread().name)
+
+    def slow(event: Event) -> None:
+        release.wait(5)
+
+    def outer(event: Event) -> None:
+        # the only worker is busy with this listener: the nested listeners get a thread of their own
+        dispatch_event(Event(EventType.COLLECT_FINISH, {}), blocking=True)
+        called.append("outer")
+
+    add_event_listener(EventType.COLLECT_BEGIN, outer, blocking=True)
+    add_event_listener(EventType.COLLECT_FINISH, inner, blocking=True)
+    add_event_listener(EventType.COLLECT_FINISH, slow, blocking=True, timeout=0)
+    try:
+        start = time.monotonic()
+        dispatch_event(Event(EventType.COLLECT_BEGIN, {}), blocking=True)
+        assert called == ["collect_finish_event-inner", "outer"]
+        # the timeout of the nested listener is enforced
+        assert time.monotonic() - start < 1
+    finally:
+        release.set()
+        remove_event_listener(EventType.COLLECT_BEGIN, outer)
+        remove_event_listener(EventType.COLLECT_FINISH, inner)
+        remove_event_listener(EventType.COLLECT_FINISH, slow)
+
+
+def test_shutdown_without_listeners(single_worker_pool: _ListenerPool) -> None:
+    dispatch_event(Event(EventType.SHUTDOWN, {"reason": "test", "emergency": False}))
+    assert single_worker_pool.is_shutdown
+
+
+def test_shutdown_waits_for_running_listeners() -> None:
+    pool = _ListenerPool(2)
+    called: List[int] = []
+
+    def slow(event: Event) -> None:
+        time.sleep(0.2)
+        called.append(event.data["n"])
+
+    futures = [pool.submit(slow, Event(EventType.PROCESS_BEGIN, {"n": n})) for n in range(2)]
+    pool.shutdown(wait=True)
+    assert sorted(called) == [0, 1]
+    assert all(future.done() for future in futures)
+    assert all(not worker.is_alive() for worker in pool.workers)
+
+
+def test_no_dispatch_after_shutdown(single_worker_pool: _ListenerPool) -> None:
+    called: List[EventType] = []
+
+    def listener(event: Event) -> None:
+        called.append(event.event_type)
+
+    add_event_listener(EventType.SHUTDOWN, listener, blocking=True)
+    add_event_listener(EventType.CLEANUP_FINISH, listener, blocking=True)
+    try:
+        dispatch_event(Event(EventType.SHUTDOWN, {"reason": "test", "emergency": False}), blocking=True)
+        assert single_worker_pool.is_shutdown
+        # the pool stays closed: late events are dropped
+        dispatch_event(Event(EventType.CLEANUP_FINISH, {}), blocking=True)
+        assert called == [EventType.SHUTDOWN]
+        assert event_module._get_executor() is single_worker_pool
+    finally:
+        remove_event_listener(EventType.SHUTDOWN, listener)
+        remove_event_listener(EventType.CLEANUP_FINISH, listener)
@@ -25,7 +25,7 @@ from resotolib.web import WebServer
 from resotolib.web.metrics import WebApp
 from prometheus_client import Summary, REGISTRY
 from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
-from resotolib.event import add_event_listener, EventType, Event as ResotoEvent
+from resotolib.event import add_event_listener, EventType, Event as ResotoEvent, add_args as event_add_args
 from threading import Event
 from typing import Optional
 from resotolib.args import ArgumentParser
@@ -53,6 +53,7 @@ def main() -> None:
     add_args(arg_parser)
     Config.add_args(arg_parser)
     resotocore_add_args(arg_parser)
+    event_add_args(arg_parser)
     logging_add_args(arg_parser)
     jwt_add_args(arg_parser)
     TLSData.add_args(arg_parser)